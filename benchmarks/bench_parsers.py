@@ -0,0 +1,186 @@
+"""
+Offline benchmark of the listing and project page parsers, no login to eprm.ypen.gr needed.
+
+Runs scrape_page, extract_project_panels, extract_panel_data for every panel id in
+id.ids, extract_panel_location, extract_panel_opinions and extract_table over the
+anonymized pages in benchmarks/fixtures, plus synthetic scale-ups of them with many
+opinion rows, table rows and coordinate points. Every case runs on both backends
+(BeautifulSoup and lxml, when installed) and reports pages/sec, panels/sec and the
+peak memory traced during one run.
+
+    python benchmarks/bench_parsers.py [repeats] [scale]
+
+scale is the number of opinion rows, table rows and coordinate points of the synthetic pages.
+tracemalloc only sees Python allocations, so the lxml peak leaves out the libxml2 tree.
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bs4 import BeautifulSoup
+
+import id as bs4_parser
+from id import ids
+from scrape import scrape_page
+
+try:
+    import id_lxml as lxml_parser
+except ImportError:
+    lxml_parser = None
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PROJECT_URL = 'https://eprm.ypen.gr/src/App/w2/100000'
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as file:
+        return file.read()
+
+
+def replace_panel(page_html, panel_id, panel_html):
+    """Swap one panel of a project page for another, e.g. a scaled-up one"""
+    pattern = re.compile(rf'<div class="panel panel-default" id="{panel_id}">.*?\n</div>\n', re.S)
+    return pattern.sub(lambda _: panel_html + '\n', page_html, count=1)
+
+
+def opinions_panel(rows):
+    """An anonymized panel-opinions with the given number of rows"""
+    body = ''.join(
+        f'<tr><td>Υπηρεσία {i}</td><td>Θετική με όρους</td>'
+        f'<td><a href="file/view/OPIN{i:06d},">Γνωμοδότηση {i}.pdf</a></td>'
+        f'<td>{i}/01-03-2025</td><td><a href="file/view/EXTR{i:06d},">Συμπληρωματικά {i}.pdf</a></td></tr>\n'
+        for i in range(rows))
+    return (f'<div class="panel panel-default" id="panel-opinions">\n<div class="panel-body">\n'
+            f'<table class="table"><tbody>\n{body}</tbody></table>\n</div>\n</div>')
+
+
+def table_panel(rows):
+    """An anonymized panel-consultation with a single table of the given number of rows"""
+    body = ''.join(
+        f'<tr><td>2025-03-{i % 28 + 1:02d}</td><td>Φορέας {i}</td>'
+        f'<td><a href="file/view/CONS{i:06d},">Σχόλια {i}.pdf</a></td></tr>\n'
+        for i in range(rows))
+    return (f'<div class="panel panel-default" id="panel-consultation">\n<div class="panel-body">\n'
+            f'<table class="table"><thead><tr><th>Ημερομηνία</th><th>Φορέας</th><th>Αρχείο</th></tr></thead>'
+            f'<tbody>\n{body}</tbody></table>\n</div>\n</div>')
+
+
+def location_panel(points):
+    """An anonymized linear panel-location with the given number of points around Athens"""
+    coords = [(f'{37.9 + i * 0.0005:.6f}', f'{23.7 + i * 0.0007:.6f}') for i in range(points)]
+    rows = ''.join(f'<div id="point_data_row_{i}"><input name="lat[]" value="{lat}"><input name="lng[]" value="{lng}"></div>\n'
+                   for i, (lat, lng) in enumerate(coords))
+    raw = '-'.join(f'{lat},{lng}' for lat, lng in coords)
+    return (f'<div class="panel panel-default" id="panel-location">\n<div class="panel-body">\n'
+            f'<input type="hidden" id="mapLatLng" value="{raw}">\n<script>var pointTYpe = "1";</script>\n'
+            f'<div id="googlemap"></div>\n'
+            f'<div class="form-group"><label class="control-label">Τοπωνύμιο</label><div class="control-view">Θέση Παράδειγμα</div></div>\n'
+            f'{rows}<ul class="hidden-chained-location"><li>ΠΕΡΙΦΕΡΕΙΑ ΑΤΤΙΚΗΣ / ΔΗΜΟΣ ΑΘΗΝΑΙΩΝ</li></ul>\n</div>\n</div>')
+
+
+class Backend:
+    """The extractors of one parser module and how to get its panels and tables out of a page"""
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def panels(self, page_html):
+        if self.module is bs4_parser:
+            return BeautifulSoup(page_html, 'html.parser').select('div.panel-default')
+        return self.module._PANELS(self.module.parse_document(page_html))
+
+    def panel(self, page_html, panel_id):
+        return next(panel for panel in self.panels(page_html) if panel.get('id') == panel_id)
+
+    def first_table(self, panel):
+        if self.module is bs4_parser:
+            return panel.find('table')
+        return self.module.find(panel, 'table')
+
+
+def measure(function, repeats):
+    """Return (seconds per run, peak traced bytes of one run)"""
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    seconds = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def report(name, function, repeats, pages=0, panels=0):
+    seconds, peak = measure(function, repeats)
+    pages_per_second = f"{pages / seconds:12,.1f}" if pages else f"{'-':>12}"
+    panels_per_second = f"{panels / seconds:12,.1f}" if panels else f"{'-':>12}"
+    print(f"{name:<48}{pages_per_second}{panels_per_second}{peak / 1024:12,.0f}")
+
+
+def bench_backend(backend, pages, repeats, scale):
+    module = backend.module
+    print(f"\n[{backend.name}]")
+    print(f"{'case':<48}{'pages/sec':>12}{'panels/sec':>12}{'peak KiB':>12}")
+
+    for page_name, page_html in pages.items():
+        count = len(backend.panels(page_html))
+        report(f"extract_project_panels {page_name}",
+               lambda: module.extract_project_panels(page_html, PROJECT_URL), repeats, pages=1, panels=count)
+
+    project = backend.panels(pages['project.html'])
+    by_id = {panel.get('id'): panel for panel in project}
+    for panel_id in sorted(ids):
+        if panel_id not in by_id:
+            print(f"{'extract_panel_data ' + panel_id:<48}{'not in the fixtures':>36}")
+            continue
+        panel = by_id[panel_id]
+        report(f"extract_panel_data {panel_id}",
+               lambda: module.extract_panel_data(panel, panel_id, PROJECT_URL), repeats, panels=1)
+
+    location = backend.panel(pages['scaled.html'], 'panel-location')
+    report(f"extract_panel_location {scale} points",
+           lambda: module.extract_panel_location(location, 'panel-location', PROJECT_URL), repeats, panels=1)
+
+    opinions = backend.panel(pages['scaled.html'], 'panel-opinions')
+    report(f"extract_panel_opinions {scale} rows",
+           lambda: module.extract_panel_opinions(opinions, 'panel-opinions', PROJECT_URL), repeats, panels=1)
+
+    table = backend.first_table(backend.panel(pages['scaled.html'], 'panel-consultation'))
+    report(f"extract_table {scale} rows",
+           lambda: module.extract_table(table, 'panel-consultation', PROJECT_URL), repeats, panels=1)
+
+
+def main(repeats=20, scale=500):
+    project_html = load_fixture('project.html')
+    scaled_html = project_html
+    scaled_html = replace_panel(scaled_html, 'panel-location', location_panel(scale))
+    scaled_html = replace_panel(scaled_html, 'panel-opinions', opinions_panel(scale))
+    scaled_html = replace_panel(scaled_html, 'panel-consultation', table_panel(scale))
+    pages = {'project.html': project_html, 'scaled.html': scaled_html}
+
+    print(f"{repeats} repeats, synthetic pages with {scale} rows and points")
+
+    listing_soup = BeautifulSoup(load_fixture('listing.html'), 'html.parser')
+    print(f"\n{'case':<48}{'pages/sec':>12}{'panels/sec':>12}{'peak KiB':>12}")
+    report("scrape_page listing.html", lambda: scrape_page(None, listing_soup), repeats, pages=1)
+
+    backends = [Backend('bs4', bs4_parser)]
+    if lxml_parser is not None:
+        backends.append(Backend('lxml', lxml_parser))
+    else:
+        print("\nlxml is not installed, skipping the lxml backend")
+
+    for backend in backends:
+        bench_backend(backend, pages, repeats, scale)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the row-record builder used by extract_table and extract_panel_opinions.
+
+Compares the old pandas path (pd.DataFrame(...).to_dict(orient='records')) with
+id.rows_to_records on an opinions panel with many rows, and reports rows/sec.
+
+    python benchmarks/bench_records.py [rows] [repeats]
+"""
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bs4 import BeautifulSoup
+from id import extract_panel_opinions, rows_to_records
+
+OPINION_COLUMNS = ['Υπηρεσία', 'Αξιολόγηση', 'Γνωμοδότηση', 'Αρ. Πρωτ. εγγράφου και ημερομηνία', 'Συμπληρωματικά στοιχεία']
+
+
+def opinions_panel(rows):
+    """An anonymized panel-opinions with the given number of rows"""
+    body = ''.join(
+        f'<tr><td>Υπηρεσία {i}</td><td>Γνωμοδοτούμε θετικά</td>'
+        f'<td><a href="file/view/OPINION{i},">Γνωμοδότηση {i}.pdf</a></td>'
+        f'<td>{i}/01-01-2025</td><td><a href="file/view/EXTRA{i},">Στοιχεία {i}.pdf</a></td></tr>'
+        for i in range(rows))
+    html = f'<div class="panel panel-default" id="panel-opinions"><table><tbody>{body}</tbody></table></div>'
+    return BeautifulSoup(html, 'html.parser').find('div')
+
+
+def rows_per_second(function, rows, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return rows * repeats / (time.perf_counter() - start)
+
+
+def pandas_import_seconds():
+    """Time of a cold `import pandas` in a fresh interpreter, None if pandas isn't installed"""
+    result = subprocess.run([sys.executable, '-c', 'import time; t = time.perf_counter(); import pandas; print(time.perf_counter() - t)'],
+                            capture_output=True, text=True)
+    return float(result.stdout) if result.returncode == 0 else None
+
+
+def main(rows=2000, repeats=20):
+    panel = opinions_panel(rows)
+    data = [[record[column] for column in OPINION_COLUMNS] for record in extract_panel_opinions(panel, 'panel-opinions', 'bench')['items']]
+
+    print(f"{rows} opinion rows, {repeats} repeats")
+
+    try:
+        import pandas as pd
+        before = rows_per_second(lambda: pd.DataFrame(data, columns=OPINION_COLUMNS).to_dict(orient='records'), rows, repeats)
+        print(f"{'records with pandas':<30}{before:12,.0f} rows/sec")
+    except ImportError:
+        before = None
+        print(f"{'records with pandas':<30}pandas not installed")
+
+    after = rows_per_second(lambda: rows_to_records(data, OPINION_COLUMNS), rows, repeats)
+    print(f"{'records with rows_to_records':<30}{after:12,.0f} rows/sec" + (f"  ({after / before:.1f}x)" if before else ""))
+
+    whole = rows_per_second(lambda: extract_panel_opinions(panel, 'panel-opinions', 'bench'), rows, max(1, repeats // 4))
+    print(f"{'extract_panel_opinions':<30}{whole:12,.0f} rows/sec")
+
+    import_seconds = pandas_import_seconds()
+    if import_seconds is not None:
+        print(f"import pandas (no longer paid by id.py): {import_seconds * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import random
+import re
+import time
+import aiohttp
+from urllib.parse import urljoin
+
+from loggers import *
+from utils import HTTP_HEADERS
+from limiter import AdaptiveLimiter
+import metrics
+
+
+SITE_URL = 'https://eprm.ypen.gr'
+
+# Configuration settings
+MAX_IN_FLIGHT = 20           # Project pages fetched at the same time when the crawl starts
+MAX_IN_FLIGHT_LIMIT = 64     # Ceiling for the adaptive limit, it grows while the server keeps up
+MAX_RETRIES = 3              # Retries for timeouts, 429 and 5xx responses
+REQUEST_TIMEOUT = 60         # Timeout for a single page in seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+MAX_PAGES_IN_FLIGHT = 64     # Pages fetched or waiting for a parser, bounds the memory held by raw html
+LISTING_PAGE_LENGTH = 1000   # Rows asked from the datatable endpoint per request
+LISTING_IN_FLIGHT = 4        # Listing pages fetched at the same time
+
+
+async def fetch_html(session, url, limiter, method='GET', params=None, data=None, raw=False, stage='page'):
+    """
+    Fetch a page while holding one of the in-flight slots of an AdaptiveLimiter, retrying transient failures.
+
+    Returns the decoded text, or (body bytes, charset) with raw=True. The requests are
+    counted in the metrics of stage, e.g. 'listing' or 'page'.
+    """
+    retries = 0
+    while True:
+        async with limiter.slot() as slot:
+            start = time.perf_counter()
+            try:
+                async with session.request(method, url, params=params, data=data) as resp:
+                    slot.record(resp.status)
+                    metrics.inc('http_responses_total', stage=stage, status=resp.status)
+                    if resp.status in RETRY_STATUSES and retries < MAX_RETRIES:
+                        retry_reason = f"HTTP {resp.status}"
+                    else:
+                        resp.raise_for_status()
+                        if 'user/login' in str(resp.url):
+                            raise Exception(f"Session expired, redirected to login page for {url}")
+                        if raw:
+                            body = await resp.read()
+                            metrics.observe('fetch_seconds', time.perf_counter() - start, stage=stage)
+                            return body, resp.charset or 'utf-8'
+                        text = await resp.text()
+                        metrics.observe('fetch_seconds', time.perf_counter() - start, stage=stage)
+                        return text
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                slot.record(error=True)
+                metrics.inc('http_errors_total', stage=stage, error=type(e).__name__)
+                if retries >= MAX_RETRIES:
+                    raise
+                retry_reason = repr(e)
+
+        # Back off outside the limiter so the slot goes to another page
+        metrics.inc('http_retries_total', stage=stage)
+        wait_time = (2 ** retries) + random.uniform(0, 1)
+        log_info(f"{retry_reason} for {url}. Retrying {retries+1}/{MAX_RETRIES} in {wait_time:.2f}s",
+                 stage='fetch', retry=retries + 1)
+        await asyncio.sleep(wait_time)
+        retries += 1
+
+
+def find_datatable_endpoint(html):
+    """
+    Find the server-side endpoint of the listing datatable in the html of a tab page.
+
+    Returns:
+    - dict: {'url', 'method', 'columns', 'order'} or None if the table is not loaded over ajax
+    """
+    match = (re.search(r'["\']?ajax["\']?\s*:\s*\{[^}]*?["\']?url["\']?\s*:\s*["\']([^"\']+)["\']', html)
+             or re.search(r'["\']?ajax["\']?\s*:\s*["\']([^"\']+)["\']', html)
+             or re.search(r'["\']?sAjaxSource["\']?\s*:\s*["\']([^"\']+)["\']', html))
+    if not match:
+        return None
+
+    ajax_block = html[match.start():match.end() + 200]
+    method = 'POST' if re.search(r'["\']?(?:type|method)["\']?\s*:\s*["\']post["\']', ajax_block, re.I) else 'GET'
+
+    columns = 0
+    thead = re.search(r'<thead.*?</thead>', html, re.S)
+    if thead:
+        columns = len(re.findall(r'<th[\s>]', thead.group(0)))
+
+    order = None
+    order_match = re.search(r'["\']?order["\']?\s*:\s*\[\s*\[\s*(\d+)\s*,\s*["\'](asc|desc)["\']', html)
+    if order_match:
+        order = (int(order_match.group(1)), order_match.group(2))
+
+    return {'url': match.group(1), 'method': method, 'columns': columns, 'order': order}
+
+
+def datatable_params(endpoint, draw, start, length):
+    """Request parameters of the DataTables server-side protocol, with the legacy names as well"""
+    params = {
+        'draw': draw, 'start': start, 'length': length,
+        'sEcho': draw, 'iDisplayStart': start, 'iDisplayLength': length,
+        'search[value]': '', 'search[regex]': 'false',
+    }
+    for i in range(endpoint['columns']):
+        params[f'columns[{i}][data]'] = i
+        params[f'columns[{i}][searchable]'] = 'true'
+        params[f'columns[{i}][orderable]'] = 'true'
+    if endpoint['order']:
+        params['order[0][column]'], params['order[0][dir]'] = endpoint['order']
+    return params
+
+
+def parse_datatable_response(payload):
+    """Return (rows, total) of a datatable response, each row as a list of cell html strings"""
+    rows = payload.get('data', payload.get('aaData', []))
+    total = payload.get('recordsFiltered', payload.get('iTotalDisplayRecords',
+                        payload.get('recordsTotal', payload.get('iTotalRecords', len(rows)))))
+
+    cells = []
+    for row in rows:
+        if isinstance(row, dict):
+            row = [value for name, value in row.items() if not name.startswith('DT_')]
+        cells.append(['' if cell is None else str(cell) for cell in row])
+    return cells, int(total)
+
+
+async def fetch_listing_rows(tab_url, cookies, limit=LISTING_IN_FLIGHT, page_length=LISTING_PAGE_LENGTH, stop=None):
+    """
+    Page through the server-side endpoint behind the listing datatable of a tab.
+
+    The first request gives the total, the remaining offsets are then requested in parallel.
+    With a stop callable (page rows -> bool) the pages are requested one at a time instead,
+    until stop returns True or the listing ends.
+
+    Returns:
+    - (title, rows, total), or None if the tab page has no server-side datatable
+    """
+    limiter = AdaptiveLimiter(initial=limit, maximum=limit, name='listing')
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    headers = {**HTTP_HEADERS, 'X-Requested-With': 'XMLHttpRequest'}
+
+    async with aiohttp.ClientSession(cookies=cookies, headers=headers, timeout=timeout) as session:
+        tab_html = await fetch_html(session, tab_url, limiter, stage='listing')
+        endpoint = find_datatable_endpoint(tab_html)
+        if endpoint is None:
+            log_info(f"No datatable endpoint found in {tab_url}")
+            return None
+
+        title_match = re.search(r'<h1[^>]*>(.*?)</h1>', tab_html, re.S)
+        title = re.sub(r'<[^>]+>', '', title_match.group(1)).strip() if title_match else ''
+        endpoint_url = urljoin(tab_url, endpoint['url'])
+
+        async def fetch_page(draw, start, length):
+            params = datatable_params(endpoint, draw, start, length)
+            if endpoint['method'] == 'POST':
+                text = await fetch_html(session, endpoint_url, limiter, method='POST', data=params, stage='listing')
+            else:
+                text = await fetch_html(session, endpoint_url, limiter, params=params, stage='listing')
+            return parse_datatable_response(json.loads(text))
+
+        rows, total = await fetch_page(1, 0, page_length)
+        log_info(f"Datatable endpoint {endpoint_url}: {len(rows)} of {total} records in the first page")
+
+        # The server may cap the page length, continue with whatever it returned
+        if 0 < len(rows) < min(page_length, total):
+            page_length = len(rows)
+
+        if stop is not None:
+            page_rows, draw = rows, 1
+            while page_rows and len(rows) < total and not stop(page_rows):
+                draw += 1
+                page_rows, _ = await fetch_page(draw, len(rows), page_length)
+                rows.extend(page_rows)
+        else:
+            offsets = range(page_length, total, page_length) if rows else []
+            pages = await asyncio.gather(*(fetch_page(i + 2, start, page_length) for i, start in enumerate(offsets)))
+            for page_rows, _ in pages:
+                rows.extend(page_rows)
+
+    return title, rows, total
+
+
+def parse_page_bytes(parse, pet, body, charset, project_url):
+    """
+    Decode a raw page and parse it, runs in the parser processes.
+
+    Returns:
+    - (result of parse, metrics recorded while parsing), for the main process to merge
+    """
+    with log_context(stage='parse', project=project_url):
+        result = parse(pet, body.decode(charset, errors='replace'), project_url)
+    return result, metrics.drain()
+
+
+async def crawl_projects(projects, tab, cookies, parse, limit=MAX_IN_FLIGHT, sink=None,
+                         executor=None, max_pages=MAX_PAGES_IN_FLIGHT, max_limit=MAX_IN_FLIGHT_LIMIT):
+    """
+    Fetch every project page of a tab concurrently and parse each one as it arrives.
+
+    Parameters:
+    - projects: the listing dicts built by scrape_page
+    - tab: tab being scraped, used for the progress log
+    - cookies: {name: value} of the authenticated session
+    - parse: callable (pet, html, project_url) -> {key: panels}, normally scrape.parse_project
+    - limit: number of requests in flight to start with, an AdaptiveLimiter raises it
+      up to max_limit while the server keeps up and cuts it on 429/5xx or slow responses
+    - sink: optional callable receiving each {key: panels} result as soon as it is parsed
+    - executor: optional ProcessPoolExecutor, the fetchers then hand the raw bytes to it
+      and the parsing runs on other cores instead of the event loop
+    - max_pages: maximum number of pages being fetched or waiting for a parser, fetching
+      pauses when the parsers fall behind
+
+    Returns:
+    - dict: {key: panels} in the same order as the listing, empty when a sink is given
+    """
+    loop = asyncio.get_running_loop()
+    max_limit = max(max_limit, limit)
+    limiter = AdaptiveLimiter(initial=limit, maximum=max_limit, name=f'crawl {tab}')
+    pages = asyncio.Semaphore(max(max_pages, max_limit))
+    connector = aiohttp.TCPConnector(limit=max_limit)
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    results = [None] * len(projects)
+
+    async with aiohttp.ClientSession(cookies=cookies, headers=HTTP_HEADERS,
+                                     connector=connector, timeout=timeout) as session:
+
+        async def scrape_one(i, project):
+            project_url = f"{SITE_URL}{project['url']}"
+            fields = {'tab': tab, 'project': project_url}
+            async with pages:
+                try:
+                    if executor is None:
+                        html = await fetch_html(session, project_url, limiter)
+                    else:
+                        body, charset = await fetch_html(session, project_url, limiter, raw=True)
+                except Exception as e:
+                    log_error(f"Failed to scrape project from {project_url}: {str(e)}", stage='fetch', **fields)
+                    return i, None
+
+                if executor is None:
+                    # The extractors' own records get the project too
+                    with log_context(stage='parse', **fields):
+                        return i, parse(project['pet'], html, project_url)
+
+                try:
+                    result, snapshot = await loop.run_in_executor(executor, parse_page_bytes, parse, project['pet'], body, charset, project_url)
+                    metrics.merge(snapshot)
+                    return i, result
+                except Exception as e:
+                    log_error(f"Failed to parse project from {project_url}: {str(e)}", stage='parse', **fields)
+                    return i, None
+
+        tasks = [asyncio.create_task(scrape_one(i, project)) for i, project in enumerate(projects)]
+
+        c = -1
+        for future in asyncio.as_completed(tasks):
+            i, result = await future
+            c += 1
+            if c % 100 == 0:
+                log_info(f"Perccent completed for this tab {tab}: {c / len(projects) * 100:.2f}% ({limiter.describe()})",
+                         tab=tab, stage='crawl', completed=c)
+
+            if sink is None:
+                results[i] = result
+            elif result:
+                sink(result)
+
+    scraped = {}
+    for result in results:
+        if result:
+            scraped.update(result)
+    return scraped
@@ -0,0 +1,176 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import WebDriverException
+from webdriver_manager.chrome import ChromeDriverManager
+
+from loggers import *
+
+
+HEADLESS = True              # Run the scraping/download drivers without a window, the login one stays visible for the CAPTCHA
+PAGE_LOAD_STRATEGY = 'eager' # driver.get returns once the DOM is ready, without waiting for images and stylesheets
+BLOCKED_URLS = [             # Static assets the scraper never looks at, blocked through CDP
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.webp',
+    '*.css', '*.woff', '*.woff2', '*.ttf', '*.eot',
+]
+DRIVER_PATH_ENV = 'CHROMEDRIVER_PATH'
+
+
+def driver_path():
+    """
+    Path of the chromedriver binary, resolved by ChromeDriverManager once.
+
+    It is kept in the CHROMEDRIVER_PATH environment variable, so the worker processes
+    started afterwards reuse it instead of checking for a new version on every driver.
+    """
+    path = os.environ.get(DRIVER_PATH_ENV)
+    if not path or not os.path.exists(path):
+        path = ChromeDriverManager().install()
+        os.environ[DRIVER_PATH_ENV] = path
+    return path
+
+
+def chrome_options(headless=HEADLESS, performance_log=False):
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.page_load_strategy = PAGE_LOAD_STRATEGY
+    if performance_log:
+        # Keeps the DevTools events, e.g. the download progress, for driver.get_log('performance')
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+    return options
+
+
+def new_driver(headless=HEADLESS, performance_log=False, block_assets=True):
+    """Start a Chrome driver with the cached chromedriver, blocking the BLOCKED_URLS unless block_assets is False"""
+    driver = webdriver.Chrome(service=Service(driver_path()), options=chrome_options(headless, performance_log))
+    if block_assets:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+    return driver
+
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+class DriverPool:
+    """
+    Drivers started once and leased to the code that needs one, instead of a new Chrome per use.
+
+    At most `size` drivers exist at a time and `spare` of them are kept started in
+    advance, so a driver that breaks is replaced without waiting for Chrome to start.
+
+        pool = DriverPool(new_driver, size=2, spare=1)
+        with pool.lease() as driver:
+            driver.get(url)
+        pool.close()
+
+    A lease that ends with a WebDriverException, or whose driver was passed to discard(),
+    quits its driver instead of returning it. Safe to share between threads.
+    """
+
+    def __init__(self, factory=new_driver, size=1, spare=0):
+        self.factory = factory
+        self.size = size
+        self.spare = spare
+        self.idle = queue.Queue()
+        self.discarded = set()
+        self.count = 0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _create(self):
+        try:
+            driver = self.factory()
+        except Exception as e:
+            log_error(f'Failed to start a pooled driver: {e}')
+            driver = None
+        if not driver:
+            with self.lock:
+                self.count -= 1
+        return driver
+
+    def _claim(self):
+        """Take a place for a new driver, False if the pool is full"""
+        with self.lock:
+            if self.closed or self.count >= self.size:
+                return False
+            self.count += 1
+            return True
+
+    def warm(self, count=None, wait=False):
+        """Start drivers in the background until `count` (default spare) are idle"""
+        missing = (self.spare if count is None else count) - self.idle.qsize()
+        threads = []
+        for _ in range(missing):
+            if not self._claim():
+                break
+            thread = threading.Thread(target=self._warm_one, daemon=True)
+            thread.start()
+            threads.append(thread)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _warm_one(self):
+        driver = self._create()
+        if driver and self.closed:
+            quit_driver(driver)
+        elif driver:
+            self.idle.put(driver)
+
+    def acquire(self, timeout=None):
+        """An idle driver, a new one if the pool isn't full, else the next one released"""
+        try:
+            driver = self.idle.get_nowait()
+        except queue.Empty:
+            driver = self._create() if self._claim() else self.idle.get(timeout=timeout)
+        if driver is None:
+            raise WebDriverException("Could not start a driver")
+        self.warm()
+        return driver
+
+    def release(self, driver):
+        if driver in self.discarded or self.closed:
+            self.discarded.discard(driver)
+            quit_driver(driver)
+            with self.lock:
+                self.count -= 1
+            self.warm()
+        else:
+            self.idle.put(driver)
+
+    def discard(self, driver):
+        """Have driver quit instead of being reused when its lease ends"""
+        self.discarded.add(driver)
+
+    @contextmanager
+    def lease(self, timeout=None):
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        except WebDriverException:
+            self.discard(driver)
+            raise
+        finally:
+            self.release(driver)
+
+    def close(self):
+        """Quit the idle drivers, the leased ones quit when they are released"""
+        self.closed = True
+        while True:
+            try:
+                quit_driver(self.idle.get_nowait())
+            except queue.Empty:
+                break
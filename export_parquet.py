@@ -0,0 +1,317 @@
+"""
+Columnar export of the Scraped/<tab>.json files for analysis.
+
+Every tab file is normalized into Parquet tables, one partition per tab:
+
+    Exported/projects/tab=w7_view/part-0.parquet
+    Exported/fields/tab=w7_view/part-0.parquet
+    Exported/opinions/...
+    Exported/points/...
+    Exported/files/...
+
+- projects: one row per project, the application_info fields with typed pet, ids and
+  submission time, and the company, location and evaluation columns used most
+- fields: every text field of every panel as (key, panel, field, value), nothing left out
+- opinions: one row per row of the opinions table, with the date of its protocol
+- points: one row per location point, WGS84 and EGSA87 coordinates as float64
+- files: one row per link, with the panel, field path and table row it was found in
+
+The tab files are read one project at a time. A tab is exported again only when its
+file changed since the previous export, see EXPORT_STATE, so re-running it after a
+scrape of a few tabs only rewrites these partitions.
+
+    python export_parquet.py               # changed tabs
+    python export_parquet.py w7_view       # only these tabs, if they changed
+    python export_parquet.py --full        # every tab
+
+Read back with e.g. pandas.read_parquet('Exported/opinions') or pyarrow.dataset.
+"""
+import json
+import os
+import re
+import shutil
+import sys
+from datetime import date, datetime
+
+from loggers import *
+from pdf_scrape.link_manifest import file_sha256, iter_projects, project_links
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+SCRAPED_DIR = "Scraped"
+EXPORT_DIR = "Exported"                                  # One folder per table, one tab=<tab> partition per tab file
+EXPORT_STATE = os.path.join(EXPORT_DIR, "_state.json")   # mtime, size and sha256 of the tab files at their last export
+SKIPPED_FILES = {"tabs.json"}
+COMPRESSION = "zstd"
+
+APPLICATION_FIELDS = {
+    'Τίτλος Έργου ή Δραστηριότητας': 'title',
+    'Σύντομος Τίτλος Έργου ή Δραστηριότητας': 'short_title',
+    'Αριθμός πρωτοκόλλου υποβολής': 'protocol',
+    'Φορέας Έργου ή Δραστηριότητας': 'carrier',
+    'Ανάθεση σε': 'assigned_to',
+}
+OPINION_FIELDS = {
+    'Υπηρεσία': 'service',
+    'Αξιολόγηση': 'evaluation',
+    'Γνωμοδότηση': 'opinion',
+    'Αρ. Πρωτ. εγγράφου και ημερομηνία': 'protocol',
+    'Συμπληρωματικά στοιχεία': 'additional',
+}
+HIERARCHY_COLUMNS = ['region', 'regional_unit', 'municipality', 'municipal_unit']
+
+# Project keys are {pet}_w{N}_{id}, see project_key in scrape.py
+_KEY = re.compile(r'^(\d+)_w(\d+)_(\d+)$')
+# d.m.yyyy, d-m-yy, d/m/yyyy... with the same separator twice, e.g. "114712/26.3.2025 (ΔΙΠΑ/...)"
+_DATE = re.compile(r'(?<!\d)(\d{1,2})([./-])(\d{1,2})\2(\d{4}|\d{2})(?!\d)')
+
+
+def _schemas():
+    string, int64, float64 = pa.string(), pa.int64(), pa.float64()
+    return {
+        'projects': pa.schema([
+            ('key', string), ('pet', int64), ('tab_number', pa.int32()), ('project_id', int64),
+            *[(column, string) for column in APPLICATION_FIELDS.values()],
+            ('status_steps', pa.list_(string)), ('submitted_at', pa.timestamp('s')),
+            ('company', string), ('company_afm', string),
+            ('location_name', string), *[(column, string) for column in HIERARCHY_COLUMNS],
+            ('point_count', pa.int32()), ('opinion_count', pa.int32()), ('evaluation', string),
+        ]),
+        'fields': pa.schema([('key', string), ('pet', int64), ('panel', string), ('field', string), ('value', string)]),
+        'opinions': pa.schema([
+            ('key', string), ('pet', int64), ('row', pa.int32()),
+            *[(column, string) for column in OPINION_FIELDS.values()],
+            ('protocol_date', pa.date32()),
+        ]),
+        'points': pa.schema([
+            ('key', string), ('pet', int64), ('point', pa.int32()), ('type', string), ('line_type', string),
+            ('lat', float64), ('lng', float64), ('egsa_x', float64), ('egsa_y', float64),
+        ]),
+        'files': pa.schema([
+            ('key', string), ('pet', int64), ('panel', string), ('field', string),
+            ('row', pa.int32()), ('url', string),
+        ]),
+    }
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_timestamp(text):
+    try:
+        return datetime.strptime(text.strip(), '%Y-%m-%d %H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_protocol_date(text):
+    """First day.month.year date of a protocol text, None if it has none that is valid"""
+    for match in _DATE.finditer(text or ''):
+        day, _, month, year = match.groups()
+        year = int(year) + 2000 if len(year) == 2 else int(year)
+        try:
+            return date(year, int(month), int(day))
+        except ValueError:
+            continue
+    return None
+
+
+def parse_key(key):
+    """(pet, tab_number, project_id) of a project key, None for the parts it doesn't have"""
+    match = _KEY.match(key)
+    if not match:
+        pet = key.split('_')[0]
+        return (int(pet) if pet.isdigit() else None), None, None
+    return tuple(int(part) for part in match.groups())
+
+
+def _evaluation(panel):
+    for field, value in panel.items():
+        if field.startswith('Αξιολόγηση') and isinstance(value, str):
+            return value
+    return None
+
+
+class TabTables:
+    """The rows of the export tables for the projects of one tab, as lists of columns"""
+
+    def __init__(self):
+        self.schemas = _schemas()
+        self.columns = {table: {name: [] for name in schema.names} for table, schema in self.schemas.items()}
+
+    def append(self, table, **row):
+        for name, values in self.columns[table].items():
+            values.append(row.get(name))
+
+    def add_project(self, key, panels):
+        pet, tab_number, project_id = parse_key(key)
+        application = panels.get('panel-application_info', {})
+        company = panels.get('panel-company_info', {})
+        location = panels.get('panel-location', {})
+        hierarchies = location.get('administrative_hierarchies') or [[]]
+        opinions = (panels.get('panel-opinions', {}).get('Γνωμοδοτήσεις') or {}).get('items', [])
+        points = (location.get('coordinates') or {}).get('points', [])
+        steps = application.get('Κατάσταση αίτησης')
+
+        self.append('projects',
+                    key=key, pet=pet, tab_number=tab_number, project_id=project_id,
+                    **{column: application.get(field) for field, column in APPLICATION_FIELDS.items()},
+                    status_steps=steps if isinstance(steps, list) else None,
+                    submitted_at=parse_timestamp(application.get('Ημερομηνία υποβολής')),
+                    company=company.get('Επωνυμία'), company_afm=company.get('ΑΦΜ'),
+                    location_name=location.get('location_name'),
+                    **dict(zip(HIERARCHY_COLUMNS, hierarchies[0])),
+                    point_count=len(points), opinion_count=len(opinions),
+                    evaluation=_evaluation(panels.get('panel-evaluation', {})))
+
+        for panel_id, panel in panels.items():
+            if isinstance(panel, dict):
+                for field, value in panel.items():
+                    if isinstance(value, str):
+                        self.append('fields', key=key, pet=pet, panel=panel_id, field=field, value=value)
+
+        for row, item in enumerate(opinions):
+            values = {column: item.get(field) for field, column in OPINION_FIELDS.items()}
+            self.append('opinions', key=key, pet=pet, row=row, **values,
+                        protocol_date=parse_protocol_date(values['protocol']))
+
+        for i, point in enumerate(points):
+            wgs84 = point.get('WGS84') or {}
+            egsa87 = point.get('EGSA87') or {}
+            self.append('points', key=key, pet=pet, point=i, type=point.get('type'),
+                        line_type=(location.get('coordinates') or {}).get('type'),
+                        lat=_to_float(wgs84.get('φ')), lng=_to_float(wgs84.get('λ')),
+                        egsa_x=_to_float(egsa87.get('x')), egsa_y=_to_float(egsa87.get('y')))
+
+        for urls, panel_id, field, row in project_links(key, panels):
+            for url in urls:
+                if url:
+                    self.append('files', key=key, pet=pet, panel=panel_id, field=field, row=row, url=url)
+
+    def tables(self):
+        return {table: pa.Table.from_pydict(columns, schema=self.schemas[table])
+                for table, columns in self.columns.items()}
+
+
+def partition_path(table, tab, export_dir=EXPORT_DIR):
+    return os.path.join(export_dir, table, f"tab={tab}", "part-0.parquet")
+
+
+def export_tab(path, tab, export_dir=EXPORT_DIR):
+    """
+    Write the partitions of one tab file in every table.
+
+    Returns:
+    - dict: number of rows written per table
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    tables = TabTables()
+    for key, panels in iter_projects(text):
+        tables.add_project(key, panels)
+
+    rows = {}
+    for table, data in tables.tables().items():
+        target = partition_path(table, tab, export_dir)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Written next to the partition and renamed, so a reader never sees half a file
+        tmp_path = target + '.tmp'
+        pq.write_table(data, tmp_path, compression=COMPRESSION)
+        os.replace(tmp_path, target)
+        rows[table] = data.num_rows
+    return rows
+
+
+def remove_tab(tab, export_dir=EXPORT_DIR):
+    for table in _schemas():
+        shutil.rmtree(os.path.dirname(partition_path(table, tab, export_dir)), ignore_errors=True)
+
+
+def load_state(path=EXPORT_STATE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=EXPORT_STATE):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def export(tabs=None, full=False, input_dir=SCRAPED_DIR, export_dir=EXPORT_DIR):
+    """
+    Export the tab files of input_dir that changed since the previous export.
+
+    Parameters:
+    - tabs: names of the tabs to export, e.g. ['w7_view'], default all of them
+    - full: export them even if they didn't change
+
+    Returns:
+    - list: the tabs exported
+    """
+    if pa is None:
+        log_error("pyarrow is needed for the Parquet export: pip install pyarrow")
+        return []
+
+    os.makedirs(export_dir, exist_ok=True)
+    state_path = os.path.join(export_dir, os.path.basename(EXPORT_STATE))
+    state = load_state(state_path)
+    available = sorted(filename[:-len('.json')] for filename in os.listdir(input_dir)
+                       if filename.endswith('.json') and filename not in SKIPPED_FILES)
+
+    # Tab files that are gone take their partitions with them
+    if tabs is None:
+        for tab in set(state) - set(available):
+            remove_tab(tab, export_dir)
+            del state[tab]
+
+    exported = []
+    for tab in (tabs or available):
+        path = os.path.join(input_dir, f"{tab}.json")
+        if not os.path.exists(path):
+            log_error(f"No scraped file for tab {tab}: {path}")
+            continue
+
+        stat = os.stat(path)
+        entry = state.get(tab)
+        if not full and entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            continue
+        digest = file_sha256(path)
+        if not full and entry and entry['sha256'] == digest:
+            entry['mtime'] = stat.st_mtime
+            continue
+
+        try:
+            with log_timing('export', tab=tab):
+                rows = export_tab(path, tab, export_dir)
+        except Exception as e:
+            log_error(f"Failed to export {path}: {e}", tab=tab)
+            continue
+        log_info(f"Exported {tab}: " + ', '.join(f"{count} {table}" for table, count in rows.items()), tab=tab, rows=rows)
+        state[tab] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': digest}
+        exported.append(tab)
+
+    save_state(state, state_path)
+    return exported
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    full = '--full' in args
+    tabs = [arg.replace('/', '_') for arg in args if arg != '--full'] or None
+    exported = export(tabs, full=full)
+    print(f"Exported {len(exported)} tabs to {EXPORT_DIR}/: {', '.join(exported) or 'nothing changed'}")
@@ -1,11 +1,12 @@
 import json
+import math
 from bs4 import BeautifulSoup
 import re
 
 from loggers import *
+import metrics
 
 
-import pandas as pd
 from pyproj import Transformer
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -36,14 +37,36 @@ ids = {'panel-location', 'panel-project_info', 'panel-clarifications', 'panel-ad
 #   'panel-studier_info'}
 
 
-def extract_panel_data(panel, panel_id, project_url):
+def extract_project_panels(page_html, project_url, reproject=True):
+    """
+    Extract every panel of a project page.
+
+    Returns:
+    - dict: {panel_id: data}, or None if the page has no panels at all
+
+    With reproject=False the EGSA87 coordinates are left to a later reproject_points call.
+    """
+    project_soup = BeautifulSoup(page_html, 'html.parser')
+    panels = project_soup.select('div.panel-default')
+    if not panels:
+        return None
+
+    results = {}
+    for panel in panels:
+        panel_id = panel.get('id', 'no_id')
+        with metrics.timer('parse_panel_seconds', panel=panel_id):
+            results.update(extract_panel_data(panel, panel_id, project_url, reproject=reproject))
+    return results
+
+
+def extract_panel_data(panel, panel_id, project_url, reproject=True):
     results = {}
     data = {}
 
     
     ### Get location panel data
     if panel_id == "panel-location":
-        return extract_panel_location(panel , panel_id, project_url)
+        return extract_panel_location(panel , panel_id, project_url, reproject=reproject)
     
 
     elif panel_id in ["panel-opinions", 'panel-publication'] :
@@ -191,7 +214,7 @@ def extract_panel_data(panel, panel_id, project_url):
         log_error(f"Error in extract_location_panel: {e}")
         return {}
 
-def extract_panel_location(panel, panel_id, project_url):
+def extract_panel_location(panel, panel_id, project_url, reproject=True):
     try:
         
         data = {}
@@ -213,50 +236,13 @@ def extract_panel_location(panel, panel_id, project_url):
             result['coordinates']['type'] = "linear" if point_type_match and point_type_match.group(1) == "1" else "single"
 
         # Extract raw coordinates
-        raw_coords = []
-        if result['coordinates']['raw']:
-            raw_coords = result['coordinates']['raw'].split('-')
-            raw_coords = [coord.split(',') for coord in raw_coords if coord]
+        raw_coords = parse_coordinates(result['coordinates']['raw'])
 
         # Extract points by matching with raw coordinates
         point_containers = panel.find_all('div', id=re.compile('point_data_row'))
-        
-        for i, container in enumerate(point_containers):
-            # Determine point type
-            point_type = ["Αρχή", "Μέση", "Τέλος"][i] if i < 3 else f"Point {i+1}"
-            
-            # Get coordinates - prioritize raw coordinates when available
-            if i < len(raw_coords):
-                lat, lng = raw_coords[i]
-            else:
-                lat = lng = None
-
-            x, y = transformer.transform(lng , lat)
-            x , y = round(x , 2) , round(y , 2) 
-            def smart_round(x):
-                if x == int(x):
-                    x = f"{int(x)}"
-                    return x
-                else: 
-                    x = str(x)
-                    return x
-                
-            x = smart_round(x)
-            y = smart_round(y)                
-                
-
-            point = {
-                "type": point_type,
-                "EGSA87": {
-                    "x": x,
-                    "y": y
-                },
-                "WGS84": {
-                    "φ": lat if lat else None,
-                    "λ": lng if lng else None
-                }
-            }
-            result['coordinates']['points'].append(point)
+        result['coordinates']['points'] = [location_point(i, raw_coords, project_url) for i in range(len(point_containers))]
+        if reproject:
+            reproject_points(result['coordinates']['points'])
 
         # Location name - look for the control-view div after the map
         map_div = panel.find('div', id='googlemap')
@@ -284,6 +270,83 @@ def extract_panel_location(panel, panel_id, project_url):
         return data
 
 
+def parse_coordinates(raw):
+    """Split the mapLatLng value "lat,lng-lat,lng" into (lat, lng) string pairs, (None, None) for a malformed pair"""
+    raw_coords = []
+    if raw:
+        for coord in raw.split('-'):
+            if coord:
+                parts = coord.split(',')
+                raw_coords.append((parts[0], parts[1]) if len(parts) == 2 else (None, None))
+    return raw_coords
+
+
+def location_point(i, raw_coords, project_url):
+    """Build the i-th point of a location panel, its EGSA87 coordinates are filled in by reproject_points"""
+    point_type = ["Αρχή", "Μέση", "Τέλος"][i] if i < 3 else f"Point {i+1}"
+
+    # Get coordinates - prioritize raw coordinates when available
+    lat, lng = raw_coords[i] if i < len(raw_coords) else (None, None)
+    if not lat or not lng:
+        log_error(f'Missing coordinates for point {point_type} in panel location for {project_url}, keeping it as null')
+
+    return {
+        "type": point_type,
+        "EGSA87": {
+            "x": None,
+            "y": None
+        },
+        "WGS84": {
+            "φ": lat if lat else None,
+            "λ": lng if lng else None
+        }
+    }
+
+
+def smart_round(x):
+    if x == int(x):
+        return f"{int(x)}"
+    return str(x)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def reproject_points(points):
+    """
+    Fill in the EGSA87 coordinates of WGS84 points with a single transformer call.
+
+    The points can come from one page or from the location panels of a whole tab
+    (see location_points). Points without valid coordinates keep x and y as None.
+    """
+    if not points:
+        return points
+
+    lngs = [_to_float(point['WGS84']['λ']) for point in points]
+    lats = [_to_float(point['WGS84']['φ']) for point in points]
+    with metrics.timer('reproject_seconds'):
+        xs, ys = transformer.transform(lngs, lats)
+    metrics.inc('reprojected_points_total', len(points))
+
+    for point, x, y in zip(points, xs, ys):
+        if math.isfinite(x) and math.isfinite(y):
+            point['EGSA87'] = {"x": smart_round(round(x, 2)), "y": smart_round(round(y, 2))}
+        else:
+            point['EGSA87'] = {"x": None, "y": None}
+    return points
+
+
+def location_points(projects):
+    """All the points of the location panels in a {key: panels} dict, e.g. a whole tab"""
+    return [point
+            for panels in projects.values()
+            for point in panels.get('panel-location', {}).get('coordinates', {}).get('points', [])]
+
+
 # extract the table for panel opinions
 def extract_panel_opinions(panel,panel_id, project_url):
     try:
@@ -338,8 +401,8 @@ def extract_panel_opinions(panel,panel_id, project_url):
             # additional_href
         ])
 
-        # Create DataFrame with text and link columns
-        df = pd.DataFrame(data, columns=[
+        # Build one record per row
+        records = rows_to_records(data, [
             'Υπηρεσία', 
             'Αξιολόγηση', 
             'Γνωμοδότηση', 
@@ -349,12 +412,11 @@ def extract_panel_opinions(panel,panel_id, project_url):
             # 'Συμπληρωματικά στοιχεία (Link)'
         ])
         
-        df_dict = df.to_dict(orient='records')
-        # Add links to the DataFrame
+        # Add links to the records
         links = list(set(links))
         
         final_dict = {}
-        final_dict['items'] = df_dict
+        final_dict['items'] = records
         final_dict['links'] = links
 
         
@@ -365,9 +427,19 @@ def extract_panel_opinions(panel,panel_id, project_url):
         return {}
     
 
-import pandas as pd
 from bs4 import BeautifulSoup
 
+def rows_to_records(rows, headers):
+    """
+    Turn table rows into one dict per row, keyed by the headers.
+
+    Gives the same records as pd.DataFrame(rows, columns=headers).to_dict(orient='records'):
+    short rows are padded with NaN and a repeated header keeps the value of its last column.
+    """
+    width = len(headers)
+    return [dict(zip(headers, row if len(row) == width else row + [math.nan] * (width - len(row)))) for row in rows]
+
+
 def extract_table(table, panel_id ,  project_url):
     """
     Extracts structured data and links from an HTML table using BeautifulSoup.
@@ -423,9 +495,8 @@ def extract_table(table, panel_id ,  project_url):
         if not headers or len(headers) != max_cols:
             headers = [f"Column {i+1}" for i in range(max_cols)]
 
-        df = pd.DataFrame(all_data, columns=headers[:max_cols])
         return {
-            'items': df.to_dict(orient='records'),
+            'items': rows_to_records(all_data, headers[:max_cols]),
             'links': list(all_links)
         }
 
@@ -0,0 +1,304 @@
+"""
+lxml implementation of the panel extractors in id.py.
+
+Every function mirrors its BeautifulSoup counterpart in id.py and returns the same
+structure, on lxml elements instead of BeautifulSoup tags. parsers.py chooses the
+backend and can run both to check that they agree.
+"""
+import re
+
+from lxml import etree, html as lxml_html
+
+from loggers import *
+import metrics
+from id import parse_coordinates, location_point, reproject_points, rows_to_records
+
+
+EMPTY_LINK = "file/view/bTVVOTdSTy9qSlkrdTVSQ1U1a2hRbzk5cXN0TFBRMnJTb3RkOXgycjNPamlXbmdWV2Q1Qnd0clM4eG1oZldqb0xpTjNTaE9kM2w5ODBpZ0llbFRyaEE9PQ,,"
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# BeautifulSoup leaves the strings of comments, <script>, <style> and <template> out of get_text
+_TEXTS = etree.XPath('.//text()[not(ancestor::script or ancestor::style or ancestor::template)]', smart_strings=False)
+
+_PANELS = etree.XPath(f'//div[{_has_class("panel-default")}]')
+_FORM_GROUPS = etree.XPath(f'.//*[{_has_class("form-group")}]')
+_CONTROL_LABEL = etree.XPath(f'(.//*[{_has_class("control-label")}])[1]')
+_CONTROL_VIEW = etree.XPath(f'(.//*[{_has_class("control-view")}])[1]')
+_NO_STYLE_UL = etree.XPath(f'(.//ul[{_has_class("no-style")}])[1]')
+_BODY_ROWS = etree.XPath('.//tr[ancestor::tbody]')                      # select('tbody tr')
+_TABLE_BODY_ROWS = etree.XPath('.//tr[ancestor::tbody[ancestor::table]]')  # select('table tbody tr')
+_MAP_LAT_LNG = etree.XPath("(.//input[@id='mapLatLng'])[1]")
+_GOOGLE_MAP = etree.XPath("(.//div[@id='googlemap'])[1]")
+_NEXT_CONTROL_VIEW = etree.XPath(f'(descendant::div[{_has_class("control-view")}] | following::div[{_has_class("control-view")}])[1]')
+_HIERARCHY_LISTS = etree.XPath(f'.//ul[{_has_class("hidden-chained-location")}]')
+
+
+def get_text(element, strip=True):
+    """Same as BeautifulSoup's get_text(strip=True), or .text with strip=False"""
+    texts = _TEXTS(element)
+    if not strip:
+        return ''.join(texts)
+    return ''.join(text for text in (text.strip() for text in texts) if text)
+
+
+def find(element, tag):
+    return next(element.iterdescendants(tag), None)
+
+
+def find_all(element, tag):
+    return list(element.iterdescendants(tag))
+
+
+def first(xpath, element):
+    found = xpath(element)
+    return found[0] if found else None
+
+
+def parse_document(page_html):
+    """Parse a whole page, None if there is nothing to parse"""
+    try:
+        return lxml_html.document_fromstring(page_html)
+    except etree.ParserError:
+        return None
+
+
+def extract_project_panels(page_html, project_url, reproject=True):
+    """
+    Extract every panel of a project page.
+
+    Returns:
+    - dict: {panel_id: data}, or None if the page has no panels at all
+    """
+    document = parse_document(page_html)
+    if document is None:
+        return None
+
+    panels = _PANELS(document)
+    if not panels:
+        return None
+
+    results = {}
+    for panel in panels:
+        panel_id = panel.get('id', 'no_id')
+        with metrics.timer('parse_panel_seconds', panel=panel_id):
+            results.update(extract_panel_data(panel, panel_id, project_url, reproject=reproject))
+    return results
+
+
+def extract_panel_data(panel, panel_id, project_url, reproject=True):
+    results = {}
+    data = {}
+
+    if panel_id == "panel-location":
+        return extract_panel_location(panel, panel_id, project_url, reproject=reproject)
+
+    elif panel_id in ["panel-opinions", 'panel-publication']:
+        data['Γνωμοδοτήσεις'] = extract_panel_opinions(panel, panel_id, project_url)
+
+    else:
+        tables = find_all(panel, "table")
+        num_tables = len(tables)
+        if num_tables > 0:
+            log_info(f'Solid Info: {num_tables} tables found for {panel_id} in {project_url}')
+        if num_tables > 1:
+            print(f'Solid Info: {num_tables} tables found for {panel_id} in {project_url}')
+
+        for j, table in enumerate(tables):
+            rows = _BODY_ROWS(table)
+            if rows:
+                data[f'table_{j}'] = extract_table(table, panel_id, project_url)
+
+    try:
+        i = 0
+        for form_group in _FORM_GROUPS(panel):
+            label_tag = first(_CONTROL_LABEL, form_group)
+            if label_tag is None:
+                text = get_text(form_group)
+                if text != "":
+                    data[f'text_{i}'] = text
+                continue
+
+            label = get_text(label_tag)
+            control_view = first(_CONTROL_VIEW, form_group)
+
+            if control_view is not None:
+                if first(_NO_STYLE_UL, control_view) is not None:
+                    list_items = find_all(control_view, 'li')
+                    items = [get_text(li) for li in list_items]
+                    links = [find(li, 'a').attrib['href'] for li in list_items if find(li, 'a') is not None]
+
+                    if links != []:
+                        links = set(links)
+                        data[label] = {"items": items, "links": list(links)}
+                    else:
+                        data[label] = items
+
+                elif find(control_view, 'table') is not None:
+                    rows = []
+                    links = []
+                    tbody = find(control_view, 'tbody')
+                    if tbody is not None:
+                        for tr in find_all(tbody, 'tr'):
+                            cells = find_all(tr, 'td')
+                            rows.append([get_text(td) for td in cells])
+                            links.append([a.attrib['href'] for td in cells for a in find_all(td, 'a')])
+
+                    if links != []:
+                        links = set(links)
+                        data[label] = {"rows": rows, "links": list(links)}
+                    else:
+                        data[label] = rows
+
+                else:
+                    text = get_text(control_view)
+                    links = [a.attrib['href'] for a in find_all(control_view, 'a')]
+                    if links != []:
+                        links = set(links)
+                        data[label] = {"text": text, "links": list(links)}
+                    else:
+                        data[label] = text
+
+            else:
+                if label == 'Έντυπο Δ11Έντυπο Δ11' or label == 'Παρατηρήσεις' or label == "":
+                    pass
+                else:
+                    log_error(f'Missing control view in a form groupp in extract panel data {panel_id} , label: {label} for {project_url}')
+
+        results[panel_id] = data
+        return results
+
+    except Exception as e:
+        log_error(f"Error in extract_panel_data (Panel ID: {panel_id}) for {project_url}: {e}")
+        return {}
+
+
+def extract_panel_location(panel, panel_id, project_url, reproject=True):
+    try:
+        data = {}
+
+        map_input = first(_MAP_LAT_LNG, panel)
+        result = {
+            "coordinates": {
+                "type": None,
+                "points": [],
+                "raw": map_input.attrib['value'] if map_input is not None else None
+            },
+            "location_name": None,
+            "administrative_hierarchies": []
+        }
+
+        # Determine point type, BeautifulSoup's string= only matches a script with a single string
+        for script in panel.iterdescendants('script'):
+            if len(script) == 0 and script.text and re.search('var pointTYpe =', script.text):
+                point_type_match = re.search(r'var pointTYpe = "(\d)"', script.text)
+                result['coordinates']['type'] = "linear" if point_type_match and point_type_match.group(1) == "1" else "single"
+                break
+
+        raw_coords = parse_coordinates(result['coordinates']['raw'])
+
+        point_containers = [div for div in panel.iterdescendants('div')
+                            if re.search('point_data_row', div.get('id', ''))]
+        result['coordinates']['points'] = [location_point(i, raw_coords, project_url) for i in range(len(point_containers))]
+        if reproject:
+            reproject_points(result['coordinates']['points'])
+
+        map_div = first(_GOOGLE_MAP, panel)
+        if map_div is not None:
+            location_div = first(_NEXT_CONTROL_VIEW, map_div)
+            if location_div is not None:
+                result['location_name'] = get_text(location_div)
+
+        for ul in _HIERARCHY_LISTS(panel):
+            for li in ul.iterdescendants('li'):
+                hierarchy = [part.strip() for part in get_text(li).split('/') if part.strip()]
+                if hierarchy:
+                    result['administrative_hierarchies'].append(hierarchy)
+
+        data[panel_id] = result
+        return data
+
+    except Exception as e:
+        log_error(f'Error in extract panel location for {project_url}: {e}')
+        data[panel_id] = {}
+        return data
+
+
+def extract_panel_opinions(panel, panel_id, project_url):
+    try:
+        rows = _TABLE_BODY_ROWS(panel)
+        if len(rows) == 0:
+            return {}
+
+        records = []
+        links = []
+        for row in rows:
+            cols = find_all(row, 'td')
+
+            opinion_link = find(cols[2], 'a')
+            opinion_href = opinion_link.attrib['href'] if opinion_link is not None and opinion_link.attrib['href'] != EMPTY_LINK else ''
+            links.append(opinion_href)
+
+            additional_data = find(cols[4], 'a')
+            additional_href = additional_data.attrib['href'] if additional_data is not None and additional_data.attrib['href'] != EMPTY_LINK else ''
+            links.append(additional_href)
+
+            records.append({
+                'Υπηρεσία': get_text(cols[0]),
+                'Αξιολόγηση': get_text(cols[1]),
+                'Γνωμοδότηση': get_text(opinion_link, strip=False) if opinion_link is not None else '',
+                'Αρ. Πρωτ. εγγράφου και ημερομηνία': get_text(cols[3]),
+                'Συμπληρωματικά στοιχεία': get_text(additional_data, strip=False) if additional_data is not None else '',
+            })
+
+        return {'items': records, 'links': list(set(links))}
+
+    except Exception as e:
+        log_error(f"Error in extract panel opinions for {panel_id} for {project_url}: {e}")
+        return {}
+
+
+def extract_table(table, panel_id, project_url):
+    try:
+        rows = _BODY_ROWS(table)
+        if not rows:
+            return {}
+
+        headers = []
+        thead = find(table, 'thead')
+        if thead is not None:
+            headers = [get_text(th) for th in thead.iterdescendants('th')]
+
+        all_data = []
+        all_links = set()
+
+        for row in rows:
+            row_data = []
+            for col in find_all(row, 'td'):
+                text = get_text(col)
+                link_tag = find(col, 'a')
+                link_href = link_tag.get('href') if link_tag is not None and link_tag.get('href') and link_tag.get('href') != EMPTY_LINK else ''
+                link_text = get_text(link_tag) if link_tag is not None else ''
+
+                row_data.append(link_text if link_href else text)
+
+                if link_href:
+                    all_links.add(link_href)
+
+            all_data.append(row_data)
+
+        max_cols = max(len(row) for row in all_data)
+        if not headers or len(headers) != max_cols:
+            headers = [f"Column {i+1}" for i in range(max_cols)]
+
+        return {
+            'items': rows_to_records(all_data, headers[:max_cols]),
+            'links': list(all_links)
+        }
+
+    except Exception as e:
+        print(f"Error extracting table from panel {panel_id} in {project_url}: {e}")
+        return {}
@@ -0,0 +1,136 @@
+import json
+import os
+
+from loggers import *
+import metrics
+
+
+FSYNC_EVERY = 50             # Lines written between two fsyncs
+
+
+def stream_path(json_path):
+    """Path of the JSON lines file a tab is streamed to before compaction, e.g. Scraped/w7_view.jsonl"""
+    return json_path + 'l'
+
+
+class JsonlWriter:
+    """
+    Append-only writer of scrape_project results, one {key: panels} object per line.
+
+    Every line is written as soon as a project is parsed and the file is fsynced every
+    fsync_every lines, so a crash loses at most the last batch instead of the whole tab.
+    """
+
+    def __init__(self, path, fsync_every=FSYNC_EVERY):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.pending = 0
+        self.count = 0
+        self.file = open(path, 'a', encoding='utf-8')
+
+        # A crash can leave a torn last line, start the next one on a fresh line
+        if self.file.tell() > 0:
+            with open(path, 'rb') as existing:
+                existing.seek(-1, os.SEEK_END)
+                if existing.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def write(self, results):
+        with metrics.timer('json_write_seconds'):
+            for key, panels in results.items():
+                self.file.write(json.dumps({key: panels}, ensure_ascii=False) + '\n')
+                self.count += 1
+                self.pending += 1
+
+            if self.pending >= self.fsync_every:
+                self.sync()
+        metrics.inc('json_records_total', len(results))
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def index_jsonl(path):
+    """Map every key of a JSON lines file to the offset of its last line, skipping a torn last line"""
+    offsets = {}
+    if not os.path.exists(path):
+        return offsets
+
+    with open(path, 'rb') as file:
+        position = 0
+        for line in file:
+            try:
+                for key in json.loads(line):
+                    offsets[key] = position
+            except json.JSONDecodeError:
+                log_error(f"Skipping unreadable line at byte {position} of {path}")
+            position += len(line)
+
+    return offsets
+
+
+def jsonl_keys(path):
+    """Keys already written to a JSON lines file by a previous, interrupted run"""
+    return set(index_jsonl(path))
+
+
+def _write_entry(out, key, value, first):
+    # Same bytes json.dump(..., indent=4) writes for one entry of the top-level dict
+    value_json = json.dumps(value, indent=4, ensure_ascii=False).replace('\n', '\n    ')
+    out.write(('\n' if first else ',\n') + '    ' + json.dumps(key, ensure_ascii=False) + ': ' + value_json)
+
+
+def compact_jsonl(jsonl_path, json_path, order=None, existing=None):
+    """
+    Turn a streamed JSON lines file into the usual Scraped/<tab>.json layout.
+
+    Parameters:
+    - jsonl_path: file written by JsonlWriter
+    - json_path: output, replaced atomically once fully written
+    - order: keys in listing order, keys missing from it follow in file order
+    - existing: entries of a previous output, written after the streamed ones
+
+    Projects are read back one at a time from their line offsets, so only the
+    offsets of the streamed file are kept in memory.
+    """
+    offsets = index_jsonl(jsonl_path)
+    existing = existing or {}
+
+    keys = [key for key in (order or []) if key in offsets]
+    listed = set(keys)
+    keys.extend(key for key in offsets if key not in listed)
+
+    tmp_path = json_path + '.tmp'
+    first = True
+    with open(tmp_path, 'w', encoding='utf-8') as out, open(jsonl_path, 'rb') as stream:
+        out.write('{')
+        for key in keys:
+            stream.seek(offsets[key])
+            _write_entry(out, key, json.loads(stream.readline())[key], first)
+            first = False
+
+        for key, value in existing.items():
+            if key not in offsets:
+                _write_entry(out, key, value, first)
+                first = False
+
+        out.write('}' if first else '\n}')
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(tmp_path, json_path)
+    os.remove(jsonl_path)
+    log_info(f"Compacted {len(keys)} streamed projects into {json_path}")
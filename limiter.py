@@ -0,0 +1,148 @@
+import asyncio
+import time
+
+
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class Slot:
+    """One request holding a place in an AdaptiveLimiter, see AdaptiveLimiter.slot"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.start = time.monotonic()
+        self.latency = None
+        self.outcome = None
+
+    def record(self, status=None, error=False):
+        """
+        Report how the request went, as soon as the response headers arrive.
+
+        429 and 5xx statuses or error=True count as congestion. The latency is measured up
+        to this call so that the time spent reading a large body doesn't count as congestion.
+        A later call with error=True, e.g. when the body times out, still counts as congestion.
+        """
+        if self.latency is None:
+            self.latency = time.monotonic() - self.start
+        if error or status in THROTTLE_STATUSES:
+            self.outcome = 'throttled'
+        elif self.outcome is None:
+            self.outcome = 'ok'
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # A request that raised before recording anything timed out or lost its connection
+        if self.outcome is None:
+            self.record(error=exc_type is not None)
+        self.limiter.release(self)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for asyncio requests, a drop-in for a fixed asyncio.Semaphore.
+
+    The limit grows by about `increase` per round trip while the responses are healthy
+    and is multiplied by `decrease` on a 429/5xx, a connection error or when the smoothed
+    latency climbs over latency_factor times the best one seen. Decreases are at most one
+    per smoothed latency, so one burst of errors from the requests already in flight only
+    cuts the limit once.
+
+        limiter = AdaptiveLimiter(initial=5, maximum=32)
+        async with limiter.slot() as slot:
+            async with session.get(url) as resp:
+                slot.record(resp.status)
+    """
+
+    def __init__(self, initial=5, minimum=1, maximum=32, increase=1.0, decrease=0.5, latency_factor=2.0, name='requests'):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.name = name
+
+        self.in_flight = 0
+        self.completed = 0
+        self.throttled = 0
+        self.latency = None
+        self.best_latency = None
+        self.last_decrease = 0.0
+        self.condition = None
+
+        self.started = time.monotonic()
+        self.last_report = (self.started, 0)
+
+    def slot(self):
+        return Slot(self)
+
+    async def acquire(self):
+        # Created here so the limiter can be built outside of the event loop that uses it
+        if self.condition is None:
+            self.condition = asyncio.Condition()
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self, slot):
+        self.in_flight -= 1
+        self.completed += 1
+        now = time.monotonic()
+
+        if slot.outcome == 'throttled':
+            self.throttled += 1
+            self._decrease(now)
+        else:
+            latency = slot.latency
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            self.best_latency = self.latency if self.best_latency is None else min(self.best_latency, self.latency)
+
+            if self.latency > self.latency_factor * self.best_latency and self._decrease(now):
+                # Accept part of the slowdown as the new normal, or the limit would keep falling
+                self.best_latency *= 1.2
+            elif self.in_flight + 1 >= int(self.limit):
+                # Only grow while the current limit is actually used
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+        asyncio.get_running_loop().create_task(self._wake())
+
+    def _decrease(self, now):
+        if now - self.last_decrease < max(self.latency or 0.0, 0.5):
+            return False
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        self.last_decrease = now
+        return True
+
+    async def _wake(self):
+        async with self.condition:
+            self.condition.notify_all()
+
+    def stats(self):
+        """Current limit and in-flight requests, plus the throughput since the previous call"""
+        now = time.monotonic()
+        since, completed = self.last_report
+        self.last_report = (now, self.completed)
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'throttled': self.throttled,
+            'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+            'per_second': round((self.completed - completed) / (now - since), 2) if now > since else 0.0,
+        }
+
+    def describe(self):
+        stats = self.stats()
+        return (f"{self.name}: limit {stats['limit']}, in flight {stats['in_flight']}, "
+                f"{stats['per_second']}/s, latency {stats['latency_ms']} ms, "
+                f"{stats['throttled']} throttled of {stats['completed']}")
+
+    async def report_every(self, seconds, output=print):
+        """Print describe() every few seconds until cancelled"""
+        while True:
+            await asyncio.sleep(seconds)
+            output(self.describe())
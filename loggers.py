@@ -1,33 +1,145 @@
+import atexit
+import contextvars
+import json
 import logging
+import multiprocessing.util
+import os
+import queue
+import sys
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_FILE = "log.jsonl"       # One JSON record per line: time, level, message, process and the fields
+CONSOLE_RATE = 5             # Errors printed per second at most, the others are only in LOG_FILE
+CONSOLE_BURST = 20           # Errors printed at once before CONSOLE_RATE applies
+
+_fields = contextvars.ContextVar('log_fields', default={})
+_listener = None
+_pid = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleRateLimit(logging.Filter):
+    """Token bucket for the console, counting the records it drops to mention them on the next one printed"""
+
+    def __init__(self, rate=CONSOLE_RATE, burst=CONSOLE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.dropped = 0
+
+    def filter(self, record):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            self.dropped += 1
+            return False
+        self.tokens -= 1
+        record.dropped, self.dropped = self.dropped, 0
+        return True
+
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        if getattr(record, 'dropped', 0):
+            message += f" ({record.dropped} more in {LOG_FILE})"
+        return message
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
 
 def get_logger():
-    log_file = f"log.txt"  
-    logger = logging.getLogger(f"logger")
-    logger.setLevel(logging.DEBUG)
-    
-    # Check if a handler already exists to avoid adding multiple handlers
-    if not logger.hasHandlers():
-        handler = logging.FileHandler(log_file, mode='a', encoding='utf-8')
-        handler.setLevel(logging.DEBUG)
-        
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
+    """
+    The logger of this process, its records go through a queue to a listener thread.
 
+    The callers only put the record in the queue. The listener writes it to LOG_FILE
+    and prints the errors, rate limited, so logging doesn't hold up the crawler. A
+    process started with fork gets its own queue and listener on its first record.
+    """
+    global _listener, _pid
+    logger = logging.getLogger("logger")
+    if _pid == os.getpid():
+        return logger
+
+    _pid = os.getpid()
+    _listener = None
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    file_handler = logging.FileHandler(LOG_FILE, mode='a', encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.WARNING)
+    console.addFilter(ConsoleRateLimit())
+    console.setFormatter(ConsoleFormatter())
+
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, file_handler, console, respect_handler_level=True)
+    _listener.start()
+    # Flush the queue at exit, multiprocessing children leave through their finalizers instead of atexit
+    atexit.register(_stop_listener)
+    multiprocessing.util.Finalize(None, _stop_listener, exitpriority=0)
+
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
     return logger
 
 
-def log_error(message, act = None):
-    logger = get_logger()
-    if act:
-        logger.error(f"❌ Error processing BOOK: {act} - {message}\n")
-        print(f"❌ Error processing BOOK: {act} - {message}")
-    else:
-        logger.error(f'❌ {message}\n')
-        print(f'❌ {message}')
+@contextmanager
+def log_context(**fields):
+    """Add fields, e.g. tab=, project=, stage=, to the records logged in this block, also by the asyncio tasks it starts"""
+    token = _fields.set({**_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        _fields.reset(token)
+
+
+@contextmanager
+def log_timing(stage, **fields):
+    """Log how long the block took as a record with stage and duration fields"""
+    start = time.perf_counter()
+    with log_context(stage=stage, **fields):
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            log_info(f"{stage} took {duration:.2f}s", duration=round(duration, 3))
+
 
-def log_info(message):
-    logger = get_logger()
-    logger.info(message)
+def _log(level, message, fields):
+    get_logger().log(level, message, extra={'fields': {**_fields.get(), **fields}})
 
 
+def log_error(message, act = None, **fields):
+    if act:
+        _log(logging.ERROR, f"❌ Error processing BOOK: {act} - {message}", fields)
+    else:
+        _log(logging.ERROR, f'❌ {message}', fields)
+
+def log_info(message, **fields):
+    _log(logging.INFO, message, fields)
@@ -20,6 +20,7 @@ import time
 from scrape import * 
 from utils import *
 from loggers import *
+from drivers import new_driver
 
 
 def is_logged_in(driver):
@@ -37,15 +38,8 @@ def is_logged_in(driver):
 
 def login(only_login=False):
     try:
-        options = Options()
-     
-        # options.add_argument("--headless")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm -usage")
-        service = Service()
-        
-
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        # Visible, the CAPTCHA is read from the window
+        driver = new_driver(headless=False, block_assets=False)
         wait = WebDriverWait(driver, 30)
         
         driver.get("https://eprm.ypen.gr/src/App/user/login")
@@ -55,6 +49,8 @@ def login(only_login=False):
                 log_info("Restored session from cookies")
                 if not only_login:
                     scrape(driver)
+                else:
+                    driver.quit()
                 return
             else: log_info('Not logged in')
             
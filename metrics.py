@@ -0,0 +1,238 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loggers import *
+
+
+METRICS_FILE = "metrics.prom"         # Prometheus textfile, rewritten every METRICS_INTERVAL seconds, None to disable
+METRICS_INTERVAL = 15                 # Seconds between two writes of METRICS_FILE
+METRICS_PORT = None                   # Port of a local /metrics endpoint, e.g. 9108, None to disable
+SUMMARY_FILE = "run_summary.json"     # JSON summary of the run written at exit
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)  # Histogram bounds in seconds
+PREFIX = "upen_"
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, counts, total):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.count += sum(counts)
+        self.sum += total
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, None if nothing was observed"""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+
+
+class Registry:
+    """
+    Counters and latency histograms of one process, keyed by name and labels.
+
+    Worker processes hand their drain() to the main process, which merge()s it, so the
+    main process exposes the totals of the whole run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the block took in the histogram name, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def drain(self):
+        """Take the values recorded since the previous drain, as a picklable snapshot for merge()"""
+        with self.lock:
+            snapshot = {
+                'counters': list(self.counters.items()),
+                'histograms': [(key, histogram.counts, histogram.sum) for key, histogram in self.histograms.items()],
+            }
+            self.counters = {}
+            self.histograms = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        with self.lock:
+            for key, value in snapshot['counters']:
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, counts, total in snapshot['histograms']:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.merge(counts, total)
+
+    def render(self):
+        """The metrics in the Prometheus text format"""
+        def labels_text(labels, extra=()):
+            pairs = [f'{name}="{str(value)}"' for name, value in (*labels, *extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{PREFIX}{name}{labels_text(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{PREFIX}{name}_bucket{labels_text(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{labels_text(labels)} {histogram.sum:.6f}")
+                lines.append(f"{PREFIX}{name}_count{labels_text(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """{counters, histograms} with count, total, mean, p50 and p95 seconds of each histogram"""
+        def name_text(name, labels):
+            return name + ''.join(f"[{label}={value}]" for label, value in labels)
+
+        with self.lock:
+            counters = {name_text(*key): value for key, value in sorted(self.counters.items())}
+            histograms = {
+                name_text(*key): {
+                    'count': histogram.count,
+                    'total_seconds': round(histogram.sum, 3),
+                    'mean_seconds': round(histogram.sum / histogram.count, 4) if histogram.count else None,
+                    'p50_seconds': histogram.quantile(0.5),
+                    'p95_seconds': histogram.quantile(0.95),
+                }
+                for key, histogram in sorted(self.histograms.items())
+            }
+        return {'counters': counters, 'histograms': histograms}
+
+
+registry = Registry()
+# A forked worker starts empty, or its first drain() would hand back the parent's values again
+os.register_at_fork(after_in_child=registry.reset)
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+drain = registry.drain
+merge = registry.merge
+
+_run = None
+
+
+def write_textfile(path=METRICS_FILE):
+    # Written next to the target and renamed, so a collector never reads half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def write_summary(path=SUMMARY_FILE):
+    finished = time.time()
+    summary = {
+        'run': _run,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(registry.started)),
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(finished)),
+        'duration_seconds': round(finished - registry.started, 1),
+        **registry.summary(),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    log_info(f"Run summary written to {path}")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _write_every(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_textfile(path)
+        except Exception as e:
+            log_error(f"Failed to write {path}: {e}")
+
+
+def start(run, textfile=METRICS_FILE, port=METRICS_PORT, summary=SUMMARY_FILE, interval=METRICS_INTERVAL):
+    """
+    Expose the metrics of this run: the textfile every interval seconds, the /metrics endpoint
+    on port, and at exit a last textfile and the JSON summary. Only the first call of a process counts.
+    """
+    global _run
+    if _run is not None:
+        return
+    _run = run
+    registry.started = time.time()
+    # Set up the log listener first, so it is still running when the summary is logged at exit
+    get_logger()
+
+    if textfile:
+        threading.Thread(target=_write_every, args=(textfile, interval), name='metrics-textfile', daemon=True).start()
+        atexit.register(write_textfile, textfile)
+    if port:
+        server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        log_info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    if summary:
+        atexit.register(write_summary, summary)
@@ -0,0 +1,61 @@
+import json
+
+from loggers import *
+from id import extract_project_panels as bs4_project_panels
+
+try:
+    import id_lxml
+except ImportError:
+    id_lxml = None
+
+
+# 'lxml' parses project pages with id_lxml, 'bs4' with BeautifulSoup and html.parser (id.py)
+PARSER_BACKEND = 'lxml'
+# Parse every page with both backends, log the panels that differ and keep the html.parser output
+PARSER_PARITY = False
+
+
+def get_backend(name=None):
+    """Return the extract_project_panels function of a backend, html.parser when lxml isn't installed"""
+    name = name or PARSER_BACKEND
+    if name == 'lxml':
+        if id_lxml is not None:
+            return id_lxml.extract_project_panels
+        log_info('lxml is not installed, parsing with html.parser')
+    return bs4_project_panels
+
+
+def extract_project_panels(page_html, project_url, backend=None, reproject=True):
+    """
+    Extract every panel of a project page with the configured backend.
+
+    Returns:
+    - dict: {panel_id: data}, or None if the page has no panels at all
+    """
+    extract = get_backend(backend)
+    if not PARSER_PARITY or extract is bs4_project_panels:
+        return extract(page_html, project_url, reproject=reproject)
+
+    reference = bs4_project_panels(page_html, project_url, reproject=reproject)
+    candidate = extract(page_html, project_url, reproject=reproject)
+    differences = compare_panels(reference, candidate)
+    if differences:
+        log_error(f"Parser parity mismatch for {project_url} in panels: {', '.join(differences)}")
+    return reference
+
+
+def compare_panels(reference, candidate):
+    """List the panel ids whose output differs between two backends, in order"""
+    if reference is None or candidate is None:
+        return [] if reference is candidate else ['<page>']
+
+    differences = []
+    for panel_id in list(reference) + [panel_id for panel_id in candidate if panel_id not in reference]:
+        # json.dumps also compares key order and treats NaN padding as equal
+        if panel_id not in reference or panel_id not in candidate or \
+                json.dumps(reference[panel_id], ensure_ascii=False) != json.dumps(candidate[panel_id], ensure_ascii=False):
+            differences.append(panel_id)
+
+    if not differences and list(reference) != list(candidate):
+        differences.append('<panel order>')
+    return differences
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import shutil
+import time
+
+
+MIN_FREE_GB = 1              # Free space kept on the disk of Files, new downloads pause below it
+CHECK_INTERVAL = 5           # Seconds between two checks of the free space while paused
+
+
+def format_size(size):
+    return f"{size / (1024 ** 3):.2f}GB"
+
+
+class Reservation:
+    """Space held by one download in a DiskBudget, see DiskBudget.reserve"""
+
+    def __init__(self, budget, expected):
+        self.budget = budget
+        self.expected = 0
+        self.expected_start = expected
+
+    def expect(self, expected):
+        """Replace the estimate with the Content-Length once the response headers arrive"""
+        if expected is None:
+            return
+        self.budget.reserved += expected - self.expected
+        self.expected = expected
+
+    def _start(self):
+        self.budget.in_flight += 1
+        self.expect(self.expected_start)
+        return self
+
+    def _end(self):
+        self.budget.in_flight -= 1
+        self.budget.reserved -= self.expected
+        self.expected = 0
+
+    async def __aenter__(self):
+        await self.budget.wait_for_room()
+        return self._start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._end()
+
+    def __enter__(self):
+        self.budget.wait_for_room_blocking()
+        return self._start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._end()
+
+
+class DiskBudget:
+    """
+    Pauses new downloads while the disk of folder is short of space, instead of killing the downloader.
+
+    Every download in flight reserves the bytes it is expected to write, first `estimate`
+    and then its Content-Length, so the room left is the free space minus these
+    reservations minus min_free. New downloads wait while there is no room, the ones in
+    flight finish normally, and intake resumes once space has been freed. Each process
+    keeps its own budget, entered with `async with budget.reserve()` from asyncio or
+    `with budget.reserve()` from a worker process.
+    """
+
+    def __init__(self, folder, min_free=MIN_FREE_GB * 1024 ** 3, estimate=0, check_interval=CHECK_INTERVAL):
+        self.folder = folder
+        self.min_free = min_free
+        self.estimate = int(estimate or 0)
+        self.check_interval = check_interval
+        self.reserved = 0
+        self.in_flight = 0
+        self.paused = False
+        os.makedirs(folder, exist_ok=True)
+
+    def free(self):
+        return shutil.disk_usage(self.folder).free
+
+    def room(self):
+        """Bytes that can still be written before the budget is reached"""
+        return self.free() - self.reserved - self.min_free
+
+    def has_room(self):
+        # A download counts only once it fits, unless nothing else is in flight to free its place
+        room = self.room() - (self.estimate if self.in_flight else 0)
+        if room <= 0 and not self.paused:
+            print(f"Disk budget reached ({format_size(self.free())} free, {format_size(self.reserved)} "
+                  f"expected from {self.in_flight} downloads in flight), pausing new downloads")
+        elif room > 0 and self.paused:
+            print(f"{format_size(self.free())} free again, resuming downloads")
+        self.paused = room <= 0
+        return not self.paused
+
+    async def wait_for_room(self):
+        while not self.has_room():
+            await asyncio.sleep(self.check_interval)
+
+    def wait_for_room_blocking(self):
+        while not self.has_room():
+            time.sleep(self.check_interval)
+
+    def reserve(self, expected=None):
+        """Context manager that waits for room, then holds expected bytes (default estimate) until it exits"""
+        return Reservation(self, self.estimate if expected is None else expected)
+
+
+def preflight(folder, remaining, average_size, min_free=MIN_FREE_GB * 1024 ** 3):
+    """
+    Print how much space the remaining downloads should need, from the average size of the done ones.
+
+    Returns:
+    - bool: False if they are not expected to fit above min_free, True otherwise or without an estimate
+    """
+    free = shutil.disk_usage(folder).free
+    if not average_size:
+        print(f"No downloaded sizes recorded yet, can't estimate the space needed ({format_size(free)} free)")
+        return True
+
+    needed = int(remaining * average_size)
+    print(f"Estimated space needed for {remaining} files: {format_size(needed)} "
+          f"(average {average_size / (1024 ** 2):.1f}MB), {format_size(free)} free")
+    if needed > free - min_free:
+        print(f"WARNING: The remaining downloads probably don't fit, they will pause "
+              f"when less than {format_size(min_free)} is free")
+        return False
+    return True
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+
+
+HASH_CHUNK = 1024 * 1024     # Bytes read at a time when hashing a file already on disk
+
+
+def file_digest(path):
+    """sha256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileStore:
+    """
+    Content-addressed store of the downloaded files under <files_dir>/.store.
+
+    Every distinct file is kept once as .store/<sha256[:2]>/<sha256> and the copies under
+    Files/<category>/ are hardlinks to it. Where hardlinks aren't supported the category
+    only gets a manifest entry pointing at the stored object. The manifest is a JSON lines
+    file of {url, path, sha256, size, linked} entries, so a URL that was downloaded once,
+    in any category, is found again before any request is made.
+    """
+
+    def __init__(self, files_dir):
+        self.files_dir = files_dir
+        self.root = os.path.join(files_dir, '.store')
+        self.manifest_path = os.path.join(self.root, 'manifest.jsonl')
+        self.urls = {}
+        os.makedirs(self.root, exist_ok=True)
+        self.load()
+
+    def load(self):
+        """Read the manifest again, e.g. after other processes added files"""
+        self.urls = {}
+        if not os.path.exists(self.manifest_path):
+            return
+
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('url'):
+                    self.urls[entry['url']] = entry
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def lookup(self, url):
+        """The manifest entry of an already stored URL, None if it has to be downloaded"""
+        entry = self.urls.get(url)
+        if entry and os.path.exists(self.object_path(entry['sha256'])):
+            return entry
+        return None
+
+    def adopt(self, path, digest, url=None):
+        """
+        Move a freshly downloaded file into the store and leave a hardlink to it at path.
+
+        If the same content is already stored the new copy is dropped for a link to the old one.
+        """
+        object_path = self.object_path(digest)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        size = os.path.getsize(path)
+
+        try:
+            os.link(path, object_path)
+            linked = True
+        except FileExistsError:
+            os.remove(path)
+            linked = self.link(digest, path)
+        except OSError:
+            os.replace(path, object_path)
+            linked = self.link(digest, path)
+
+        self.record(url, path, digest, size, linked)
+        return object_path
+
+    def link(self, digest, path, url=None):
+        """
+        Give path the content of a stored object, as a hardlink or else a manifest entry.
+
+        Returns:
+        - bool: True if path is a file on disk, False if only the manifest points at the object
+        """
+        if os.path.exists(path):
+            return True
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(self.object_path(digest), path)
+            linked = True
+        except FileExistsError:
+            linked = True
+        except OSError:
+            linked = False
+
+        if url is not None or not linked:
+            self.record(url, path, digest, os.path.getsize(self.object_path(digest)), linked)
+        return linked
+
+    def record(self, url, path, digest, size, linked):
+        entry = {
+            'url': url,
+            'path': os.path.relpath(path, self.files_dir),
+            'filename': os.path.basename(path),
+            'sha256': digest,
+            'size': size,
+            'linked': linked,
+        }
+        # One short line per append, so several processes can share the manifest
+        with open(self.manifest_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        if url:
+            self.urls[url] = entry
+
+
+def group_urls(all_links):
+    """
+    De-duplicate the links of get_all_links across categories before downloading.
+
+    Returns:
+    - dict: {url: [categories]} with every url once, in first-seen order
+    """
+    url_categories = {}
+    for category, links in all_links.items():
+        for url in links:
+            if url and url.strip():
+                categories = url_categories.setdefault(url, [])
+                if category not in categories:
+                    categories.append(category)
+    return url_categories
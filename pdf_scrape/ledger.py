@@ -0,0 +1,138 @@
+import json
+import os
+import sqlite3
+import time
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LEDGER_FILE = os.path.join(SCRIPT_DIR, "downloads.sqlite3")
+GLOBAL_PROGRESS_FILE = os.path.join(SCRIPT_DIR, "global_progress.json")
+BUSY_TIMEOUT = 60            # Seconds a process waits for another one's write to finish
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    category   TEXT NOT NULL,
+    url        TEXT NOT NULL,
+    status     TEXT NOT NULL DEFAULT 'pending',
+    filename   TEXT,
+    size       INTEGER,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (category, url)
+);
+CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status);
+CREATE INDEX IF NOT EXISTS downloads_filename ON downloads (category, filename COLLATE NOCASE);
+"""
+
+
+class Ledger:
+    """
+    Download ledger shared by pdfs.py and selenium_pdfs.py, one row per (category, url).
+
+    Every update is its own small transaction in an sqlite3 database in WAL mode, so any
+    number of worker processes can record their downloads while others read, and a resume
+    check is a primary key lookup instead of reloading a JSON file. Each process opens
+    its own Ledger. The entries of the old global_progress.json are imported on first use.
+    """
+
+    def __init__(self, path=LEDGER_FILE, progress_file=GLOBAL_PROGRESS_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+        self.migrate(progress_file)
+
+    def migrate(self, progress_file):
+        """Import the "category/url" entries of global_progress.json as done, once"""
+        if not progress_file or not os.path.exists(progress_file):
+            return
+        if self.conn.execute("SELECT 1 FROM downloads LIMIT 1").fetchone():
+            return
+
+        try:
+            with open(progress_file, "r", encoding="utf-8") as f:
+                file_ids = json.load(f)
+        except Exception as e:
+            print(f"Warning: Failed to import {progress_file}: {e}")
+            return
+
+        now = time.time()
+        rows = [(*file_id.split('/', 1), now) for file_id in file_ids if '/' in file_id]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO downloads (category, url, status, updated_at) VALUES (?, ?, 'done', ?)", rows)
+        print(f"Imported {len(rows)} completed downloads from {progress_file}")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_done(self, category, url):
+        row = self.conn.execute("SELECT status FROM downloads WHERE category = ? AND url = ?", (category, url)).fetchone()
+        return row is not None and row[0] == 'done'
+
+    def has_file(self, category, filename):
+        """Whether a download of this category was saved under filename, ignoring case"""
+        return self.conn.execute(
+            "SELECT 1 FROM downloads WHERE category = ? AND filename = ? COLLATE NOCASE AND status = 'done' LIMIT 1",
+            (category, filename)).fetchone() is not None
+
+    def done_keys(self):
+        """All the (category, url) pairs already downloaded"""
+        return set(self.conn.execute("SELECT category, url FROM downloads WHERE status = 'done'"))
+
+    def mark_started(self, category, url):
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO downloads (category, url, status, attempts, updated_at) VALUES (?, ?, 'downloading', 1, ?)
+                   ON CONFLICT (category, url) DO UPDATE SET status = 'downloading', attempts = attempts + 1,
+                   updated_at = excluded.updated_at""",
+                (category, url, time.time()))
+
+    def mark_done(self, category, url, filename=None, size=None):
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO downloads (category, url, status, filename, size, updated_at) VALUES (?, ?, 'done', ?, ?, ?)
+                   ON CONFLICT (category, url) DO UPDATE SET status = 'done', last_error = NULL,
+                   filename = COALESCE(excluded.filename, filename), size = COALESCE(excluded.size, size),
+                   updated_at = excluded.updated_at""",
+                (category, url, filename, size, time.time()))
+
+    def mark_failed(self, category, url, error):
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO downloads (category, url, status, last_error, updated_at) VALUES (?, ?, 'failed', ?, ?)
+                   ON CONFLICT (category, url) DO UPDATE SET status = 'failed', last_error = excluded.last_error,
+                   updated_at = excluded.updated_at""",
+                (category, url, str(error), time.time()))
+
+    def failed(self, max_attempts=None):
+        """(category, url, attempts, last_error) of the failed downloads, to retry them"""
+        query = "SELECT category, url, attempts, last_error FROM downloads WHERE status = 'failed'"
+        if max_attempts is not None:
+            return self.conn.execute(query + " AND attempts < ?", (max_attempts,)).fetchall()
+        return self.conn.execute(query).fetchall()
+
+    def average_size(self):
+        """Average size in bytes of the done downloads, None before any size was recorded"""
+        return self.conn.execute("SELECT AVG(size) FROM downloads WHERE status = 'done' AND size IS NOT NULL").fetchone()[0]
+
+    def counts(self):
+        """{status: number of downloads}"""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM downloads GROUP BY status"))
+
+
+if __name__ == "__main__":
+    # Summary of the ledger and the downloads to retry
+    with Ledger() as ledger:
+        print(ledger.counts())
+        for category, url, attempts, last_error in ledger.failed():
+            print(f"{category}/{url} ({attempts} attempts): {last_error}")
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import re
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILE = os.path.join(SCRIPT_DIR, "link_manifest.json")
+MANIFEST_VERSION = 1
+SKIPPED_FILES = {"tabs.json"}
+
+_SEPARATOR = re.compile(r'[\s,]*')
+_COLON = re.compile(r'\s*:\s*')
+
+
+def file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def iter_projects(text):
+    """
+    Yield the (key, panels) items of a scraped tab file one at a time.
+
+    Only the text of the file is held at once, not a dict of the whole tab.
+    """
+    decoder = json.JSONDecoder()
+    i = _SEPARATOR.match(text).end()
+    if text[i:i + 1] != '{':
+        raise ValueError("Expected a JSON object of {key: panels}")
+    i += 1
+
+    while True:
+        i = _SEPARATOR.match(text, i).end()
+        if text[i:i + 1] == '}':
+            return
+        key, i = decoder.raw_decode(text, i)
+        i = _COLON.match(text, i).end()
+        panels, i = decoder.raw_decode(text, i)
+        yield key, panels
+
+
+def project_links(key, panels):
+    """
+    Yield (urls, panel_id, field, row) for every "links" list in the panels of one project.
+
+    field is the path of keys from the panel to the list, row the index of the table row
+    it is in, if any. Runs over an explicit stack in document order, without recursion.
+    """
+    stack = [(panels, None, (), None)]
+    while stack:
+        obj, panel_id, path, row = stack.pop()
+        if isinstance(obj, dict):
+            children = []
+            for name, value in obj.items():
+                if name == "links" and isinstance(value, list):
+                    yield value, panel_id, '/'.join(path), row
+                elif panel_id is None:
+                    children.append((value, name, (), row))
+                else:
+                    children.append((value, panel_id, path + (name,), row))
+            stack.extend(reversed(children))
+        elif isinstance(obj, list):
+            stack.extend(reversed([(item, panel_id, path, i) for i, item in enumerate(obj)]))
+
+
+def extract_file_links(path):
+    """
+    One pass over a scraped tab file.
+
+    Returns:
+    - (links, count): links as [category, url, panel_id, field, row] once per (category, url),
+      with the first place it was found, and count the number of "links" keys, as before
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    links = []
+    seen = set()
+    count = 0
+    for key, panels in iter_projects(text):
+        for urls, panel_id, field, row in project_links(key, panels):
+            count += 1
+            for url in urls:
+                if url and (key, url) not in seen:
+                    seen.add((key, url))
+                    links.append([key, url, panel_id, field, row])
+    return links, count
+
+
+class LinkManifest:
+    """
+    Cached de-duplicated links of the Scraped/ tab files, with where each one was found.
+
+    Every source file has its links kept in MANIFEST_FILE with its mtime, size and sha256.
+    A file is read again only when it changed: same mtime and size reuse the entry at
+    once, a new mtime with the same sha256 only refreshes it.
+    """
+
+    def __init__(self, input_dir, path=MANIFEST_FILE):
+        self.input_dir = os.path.abspath(input_dir)
+        self.path = path
+        self.sources = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Made for another Scraped/ directory or an older layout, start over
+        if manifest.get('version') == MANIFEST_VERSION and manifest.get('input_dir') == self.input_dir:
+            self.sources = manifest.get('sources', {})
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'input_dir': self.input_dir, 'sources': self.sources}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def source_files(self):
+        return sorted(filename for filename in os.listdir(self.input_dir)
+                      if filename.endswith(".json") and filename not in SKIPPED_FILES)
+
+    def refresh(self):
+        """Bring the cached entries up to date with the files, returns the names of the files read again"""
+        changed = []
+        filenames = self.source_files()
+        for filename in filenames:
+            filepath = os.path.join(self.input_dir, filename)
+            stat = os.stat(filepath)
+            entry = self.sources.get(filename)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+
+            digest = file_sha256(filepath)
+            if entry and entry['sha256'] == digest:
+                entry['mtime'] = stat.st_mtime
+                changed.append(filename)
+                continue
+
+            try:
+                links, count = extract_file_links(filepath)
+            except Exception as e:
+                print(f"Error reading {filename}: {e}")
+                continue
+            self.sources[filename] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'sha256': digest,
+                'count': count,
+                'links': links,
+            }
+            changed.append(filename)
+
+        # Forget the files that were removed
+        for filename in set(self.sources) - set(filenames):
+            del self.sources[filename]
+            changed.append(filename)
+
+        if changed:
+            self.save()
+        return changed
+
+    def links(self):
+        """Every [category, url, panel_id, field, row] of the manifest, file by file"""
+        for filename in sorted(self.sources):
+            yield from self.sources[filename]['links']
+
+    def counts(self):
+        return {filename: entry['count'] for filename, entry in sorted(self.sources.items())}
@@ -1,10 +1,13 @@
 import os
+import re
 import json
+import hashlib
 import asyncio
 import aiohttp
 import aiofiles
 import random
 import time
+from contextlib import nullcontext
 from tqdm.asyncio import tqdm_asyncio
 from urllib.parse import unquote
 import pickle
@@ -16,6 +19,14 @@ from http.cookies import SimpleCookie
 from aiohttp import ClientSession, CookieJar
 
 from login import login
+from session_broker import SessionBroker
+from limiter import AdaptiveLimiter
+from file_store import FileStore, file_digest, group_urls
+from ledger import Ledger
+from link_manifest import LinkManifest
+from loggers import log_info
+import metrics
+from disk_budget import DiskBudget, preflight
 
 
 async def create_authenticated_session_with_selenium(driver):
@@ -112,57 +123,38 @@ INPUT_DIR = 'Scraped'
 BASE_URL = "https://eprm.ypen.gr/src/App/"
 
 # Configuration settings
-MAX_CONCURRENT_REQUESTS = 5  # Reduced from original
+MAX_CONCURRENT_REQUESTS = 5  # Concurrent downloads to start with, the limiter adapts it
+MIN_CONCURRENT_REQUESTS = 1  # Floor the limiter backs off to on 429/5xx or slow responses
+MAX_CONCURRENCY_LIMIT = 32   # Ceiling the limiter grows to while the server keeps up
 MAX_RETRIES = 3              # Add retry logic
-MIN_DELAY = 0.5              # Minimum delay between requests in seconds
-MAX_DELAY = 2.0              # Maximum delay between requests in seconds
-REQUEST_TIMEOUT = 60         # Timeout for requests in seconds
+REPORT_INTERVAL = 30         # Seconds between two reports of the live concurrency and throughput
+REQUEST_TIMEOUT = 60         # Timeout for connecting and for the response headers in seconds
+CHUNK_SIZE = 64 * 1024       # Bytes read from the response and written to disk at a time
+MIN_THROUGHPUT = 2 * 1024    # Bytes/sec under which a download counts as stalled
+STALL_WINDOW = 30            # Seconds the throughput is measured over before giving up on a download
 
 os.makedirs(FILES_DIR, exist_ok=True)
 
-def extract_links(obj, parent_key=None):
-    links_dict = {}
-    count = 0
-
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key == "links" and isinstance(value, list):
-                if parent_key:  # Add links under the top-level parent
-                    links_dict.setdefault(parent_key, []).extend(value)
-                count += 1
-            else:
-                # Pass the current key as parent_key only if it's not "links"
-                sub_links, sub_count = extract_links(value, parent_key or key)
-                for k, v in sub_links.items():
-                    links_dict.setdefault(k, []).extend(v)
-                count += sub_count
+def get_all_links():
+    """
+    Links of every scraped tab file by category, i.e. project key, from the cached link manifest.
 
-    elif isinstance(obj, list):
-        for item in obj:
-            sub_links, sub_count = extract_links(item, parent_key)
-            for k, v in sub_links.items():
-                links_dict.setdefault(k, []).extend(v)
-            count += sub_count
+    Only the files of INPUT_DIR that changed since the previous run are read again.
 
-    return links_dict, count
+    Returns:
+    - (all_links, file_link_counts): {category: [urls]} with every url once per category,
+      and {filename: number of "links" lists found}
+    """
+    manifest = LinkManifest(INPUT_DIR)
+    changed = manifest.refresh()
+    if changed:
+        print(f"Link manifest updated for {len(changed)} files: {', '.join(changed)}")
 
-def get_all_links():
     all_links = {}
-    file_link_counts = {}
-
-    for filename in os.listdir(INPUT_DIR):
-        if filename.endswith(".json") and filename != "tabs.json":
-            filepath = os.path.join(INPUT_DIR, filename)
-            with open(filepath, "r", encoding="utf-8") as f:
-                try:
-                    data = json.load(f)
-                    links_dict, count = extract_links(data)
-                    for k, v in links_dict.items():
-                        all_links.setdefault(k, []).extend(v)
-                    file_link_counts[filename] = count
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
+    for category, url, panel_id, field, row in manifest.links():
+        all_links.setdefault(category, []).append(url)
 
+    file_link_counts = manifest.counts()
     for fname, count in file_link_counts.items():
         print(f"{fname}: {count} 'links' keys found.")
 
@@ -211,15 +203,197 @@ def get_filename_from_response(response):
     return filename
 
 
-async def download_file(session, url, dest_folder, category, pbar, semaphore):
+class StalledDownload(asyncio.TimeoutError):
+    """A download stayed under MIN_THROUGHPUT for a whole STALL_WINDOW"""
+
+
+def partial_paths(folder, url):
+    """Paths of the .part file of a url and of its sidecar with the offset and validator"""
+    name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    partial_dir = os.path.join(folder, '.partial')
+    return os.path.join(partial_dir, name + '.part'), os.path.join(partial_dir, name + '.json')
+
+
+def load_partial(part_path, meta_path, url):
+    """
+    The interrupted download of a url, if one was kept.
+
+    Returns:
+    - dict: {'url', 'offset', 'validator', 'total'} or None
+    """
+    if not (os.path.exists(part_path) and os.path.exists(meta_path)):
+        return None
+
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            partial = json.load(f)
+    except Exception:
+        discard_partial(part_path, meta_path)
+        return None
+
+    # The sidecar is written after the data, trust whichever of the two is shorter
+    offset = min(partial.get('offset', 0), os.path.getsize(part_path))
+    if partial.get('url') != url or not partial.get('validator') or offset <= 0:
+        discard_partial(part_path, meta_path)
+        return None
+
+    partial['offset'] = offset
+    return partial
+
+
+def save_partial(meta_path, url, offset, validator, total):
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'offset': offset, 'validator': validator, 'total': total}, f)
+
+
+def discard_partial(part_path, meta_path):
+    for stale in (part_path, meta_path):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def resume_headers(partial):
+    """Ask for the rest of an interrupted download, the server sends the whole file instead if it changed"""
+    if not partial:
+        return None
+    return {'Range': f"bytes={partial['offset']}-", 'If-Range': partial['validator']}
+
+
+def response_validator(resp):
+    """A validator usable in If-Range: a strong ETag or else Last-Modified"""
+    etag = resp.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return resp.headers.get('Last-Modified')
+
+
+def content_range(resp):
+    """(start, total) of a 206 response, total None if unknown"""
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', resp.headers.get('Content-Range', ''))
+    if not match:
+        return None, None
+    return int(match.group(1)), None if match.group(2) == '*' else int(match.group(2))
+
+
+async def stream_to_file(resp, path, part_path=None, meta_path=None, url=None, partial=None):
+    """
+    Write a response body to a .part file chunk by chunk and move it to path once complete.
+
+    Only one chunk is held in memory, however big the file. Instead of a total timeout the
+    throughput is checked every STALL_WINDOW seconds and the download is aborted with
+    StalledDownload when it stays under MIN_THROUGHPUT, so large files on slow links finish.
+
+    With meta_path and url an interrupted download is kept: the .part file stays and the
+    sidecar at meta_path records its offset and the response validator, so the next
+    attempt can ask for the rest with resume_headers. A 206 answer to such a request is
+    appended to the kept part, a 200 means the server ignored the range or the file
+    changed, and the part is rewritten from the start.
+
+    Returns:
+    - (bytes written, sha256 hex digest of the body)
+    """
+    part_path = part_path or path + '.part'
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    digest = hashlib.sha256()
+    offset = 0
+
+    if resp.status == 206 and partial:
+        start, total = content_range(resp)
+        if start != partial['offset']:
+            discard_partial(part_path, meta_path)
+            raise Exception(f"Server resumed at byte {start} instead of {partial['offset']}")
+
+        offset = partial['offset']
+        validator = partial['validator']
+        # Drop whatever was written after the recorded offset and hash the kept bytes
+        with open(part_path, 'r+b') as f:
+            f.truncate(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        validator = response_validator(resp)
+        total = resp.content_length
+
+    resumable = meta_path is not None and url is not None and validator is not None and \
+        (resp.status == 206 or resp.headers.get('Accept-Ranges', '').lower() == 'bytes')
+
+    written = offset
+    window_start = time.monotonic()
+    window_bytes = 0
+
+    try:
+        async with aiofiles.open(part_path, mode='ab' if offset else 'wb') as f:
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                await f.write(chunk)
+                digest.update(chunk)
+                written += len(chunk)
+                window_bytes += len(chunk)
+
+                elapsed = time.monotonic() - window_start
+                if elapsed >= STALL_WINDOW:
+                    if window_bytes / elapsed < MIN_THROUGHPUT:
+                        raise StalledDownload(f"Download stalled at {window_bytes / elapsed:.0f} bytes/sec after {written} bytes")
+                    window_start = time.monotonic()
+                    window_bytes = 0
+
+    except BaseException:
+        if resumable and written > 0 and os.path.exists(part_path):
+            save_partial(meta_path, url, written, validator, total)
+            print(f"Kept {written} bytes of {url} to resume later")
+        else:
+            discard_partial(part_path, meta_path)
+        raise
+
+    try:
+        # Check if content is valid (not empty or error page)
+        if written < 100:  # Arbitrary check for very small files that might be error pages
+            async with aiofiles.open(part_path, mode='rb') as f:
+                content_str = (await f.read()).decode('utf-8', errors='ignore')
+            if "error" in content_str.lower() or "not found" in content_str.lower():
+                raise Exception(f"Received error page: {content_str[:100]}...")
+
+        os.replace(part_path, path)
+        return written, digest.hexdigest()
+
+    finally:
+        discard_partial(part_path, meta_path)
+
+
+async def refresh_session(session, broker, generation):
+    """Swap the cookies of an expired session for the broker's new ones, the broker logs in at most once per generation"""
+    generation, cookies = await asyncio.to_thread(broker.refresh, generation)
+    session.cookie_jar.update_cookies({cookie['name']: cookie['value'] for cookie in cookies}, URL(BASE_URL))
+    return generation
+
+
+def link_stored(store, entry, dest_folder, categories):
+    """Give every category a copy of an already stored file, without downloading it again"""
+    for category in categories:
+        store.link(entry['sha256'], os.path.join(dest_folder, category, entry['filename']))
+
+
+async def download_file(session, url, dest_folder, category, pbar, limiter, broker=None, store=None, also_in=(), budget=None):
+    """
+    Download one url into dest_folder/category.
+
+    With a FileStore the file is stored once by content and also linked into the
+    also_in categories, and a url that is already in the store is linked without a request.
+    With a DiskBudget the request waits while the disk is short of space.
+    """
+    entry = store.lookup(url) if store else None
+    if entry:
+        link_stored(store, entry, dest_folder, [category, *also_in])
+        pbar.update(1)
+        return True, f"Linked from store: {category}/{entry['filename']}"
+
     retries = 0
     while retries <= MAX_RETRIES:
+        if retries:
+            metrics.inc('download_retries_total', downloader='aiohttp')
+        generation = broker.cookies()[0] if broker else None
         try:
-            # Wait for semaphore to control concurrency
-            async with semaphore:
-                # Add random delay to avoid rate limiting
-                await asyncio.sleep(random.uniform(MIN_DELAY, MAX_DELAY))
-                
+            # Wait for room on the disk, then for a slot of the adaptive limiter to control concurrency
+            async with budget.reserve() if budget else nullcontext() as reservation, limiter.slot() as slot:
                 # Create category subfolder
                 category_folder = os.path.join(dest_folder, category)
                 os.makedirs(category_folder, exist_ok=True)
@@ -229,11 +403,21 @@ async def download_file(session, url, dest_folder, category, pbar, semaphore):
                 
                 full_url = BASE_URL + url
                 
+                # Continue an interrupted download from where it stopped
+                part_path, meta_path = partial_paths(category_folder, url)
+                partial = load_partial(part_path, meta_path, url)
+
                 # Add detailed error capture
+                start = time.perf_counter()
                 try:
-                    async with session.get(full_url, timeout=REQUEST_TIMEOUT) as resp:
-                        print(full_url)
-                        if resp.status == 200:
+                    async with session.get(full_url, headers=resume_headers(partial)) as resp:
+                        log_info(f"GET {full_url}: {resp.status}", stage='download', category=category, url=url)
+                        metrics.inc('download_responses_total', downloader='aiohttp', status=resp.status)
+                        slot.record(resp.status)
+                        if resp.status in (200, 206):
+                            if reservation:
+                                reservation.expect(resp.content_length)
+
                             # Get the filename from the response
                             filename = get_filename_from_response(resp)
                             
@@ -248,25 +432,29 @@ async def download_file(session, url, dest_folder, category, pbar, semaphore):
                             
                             # Skip if already downloaded
                             if os.path.exists(path):
+                                discard_partial(part_path, meta_path)
+                                if store:
+                                    # Downloaded before the store existed, index it so it isn't requested again
+                                    store.adopt(path, file_digest(path), url)
+                                    link_stored(store, store.urls[url], dest_folder, also_in)
                                 pbar.update(1)
                                 return True, f"Skipped (already exists): {category}/{filename}"
                             
-                            # Read response content
-                            content = await resp.read()
-                            
-                            # Check if content is valid (not empty or error page)
-                            if len(content) < 100:  # Arbitrary check for very small files that might be error pages
-                                content_str = content.decode('utf-8', errors='ignore')
-                                if "error" in content_str.lower() or "not found" in content_str.lower():
-                                    raise Exception(f"Received error page: {content_str[:100]}...")
-                            
-                            # Save file
-                            async with aiofiles.open(path, mode='wb') as f:
-                                await f.write(content)
+                            # Stream the body to disk, it is only renamed to path once complete
+                            written, digest = await stream_to_file(resp, path, part_path, meta_path, url, partial)
+                            metrics.inc('download_bytes_total', written, downloader='aiohttp')
+                            metrics.observe('download_seconds', time.perf_counter() - start, downloader='aiohttp')
+                            if store:
+                                store.adopt(path, digest, url)
+                                link_stored(store, store.urls[url], dest_folder, also_in)
                             
                             pbar.update(1)
                             print(f"Downloaded: {category}/{filename}")
                             return True, f"Downloaded: {category}/{filename}"
+                        elif resp.status == 416 and partial:  # The kept part doesn't fit the file anymore
+                            discard_partial(part_path, meta_path)
+                            retries += 1
+                            continue
                         elif resp.status == 429:  # Too Many Requests
                             if retries < MAX_RETRIES:
                                 # Exponential backoff for rate limiting
@@ -279,6 +467,10 @@ async def download_file(session, url, dest_folder, category, pbar, semaphore):
                                 pbar.update(1)
                                 return False, f"Failed after {MAX_RETRIES} retries due to rate limiting: {url}"
                         elif resp.status == 403:  # Forbidden
+                            if broker and retries < MAX_RETRIES and not await verify_session(session):
+                                await refresh_session(session, broker, generation)
+                                retries += 1
+                                continue
                             pbar.update(1)
                             return False, f"Access denied (403): {url} - May need authentication or session refresh"
                         else:
@@ -297,6 +489,7 @@ async def download_file(session, url, dest_folder, category, pbar, semaphore):
                                 pbar.update(1)
                                 return False, f"Failed {url} | Status: {resp.status} | {error_preview}"
                 except asyncio.TimeoutError:
+                    slot.record(error=True)
                     if retries < MAX_RETRIES:
                         print(f"Timeout for {url}. Retrying {retries+1}/{MAX_RETRIES}...")
                         retries += 1
@@ -323,19 +516,40 @@ async def download_file(session, url, dest_folder, category, pbar, semaphore):
                 return False, f"Error after {MAX_RETRIES} retries: {url} - {str(e)}"
 
 
+async def download_recorded(ledger, session, url, categories, pbar, limiter, broker=None, store=None, budget=None):
+    """download_file for the first of categories, recording the outcome of every category in the ledger"""
+    ledger.mark_started(categories[0], url)
+    success, message = await download_file(session, url, FILES_DIR, categories[0], pbar, limiter, broker,
+                                           store=store, also_in=categories[1:], budget=budget)
+
+    metrics.inc('downloads_total', downloader='aiohttp', result='ok' if success else 'failed')
+    entry = store.urls.get(url, {}) if store else {}
+    for category in categories:
+        if success:
+            ledger.mark_done(category, url, entry.get('filename'), entry.get('size'))
+        else:
+            ledger.mark_failed(category, url, message)
+    return success, message
+
+
 from utils import *
 
 
 async def main():
-    driver = create_driver('https://eprm.ypen.gr/')
-    save_cookies(driver)
+    # Log in once, the broker hands the cookies to the session and logs in again if they expire
+    metrics.start('pdfs')
+    broker = SessionBroker()
+    try:
+        await asyncio.to_thread(broker.start)
+        await download_all(broker)
+    finally:
+        broker.close()
 
-    if not driver:
-        raise Exception("Failed to create driver or load cookies")
-    
-    # Get cookies in aiohttp format
-    jar = get_cookies_for_aiohttp(driver)
-    driver.quit()
+
+async def download_all(broker):
+    generation, cookies = broker.cookie_dict()
+    jar = aiohttp.CookieJar(unsafe=True)
+    jar.update_cookies(cookies, URL(BASE_URL))
 
 
     all_links, _ = get_all_links()
@@ -344,6 +558,19 @@ async def main():
     total_links = sum(len(links) for links in all_links.values())
     
     print(f"Found {total_links} files to download across {len(all_links)} categories.")
+
+    # Every url is requested once, the other categories it appears in get links to the stored file
+    url_categories = group_urls(all_links)
+    store = FileStore(FILES_DIR)
+
+    # Skip the urls the ledger has as done in all their categories
+    ledger = Ledger()
+    done = ledger.done_keys()
+    url_categories = {url: categories for url, categories in url_categories.items()
+                      if any((category, url) not in done for category in categories)}
+    stored = sum(1 for url in url_categories if store.lookup(url))
+    print(f"{len(url_categories)} unique urls left to download, {stored} of them already in the store.")
+    preflight(FILES_DIR, len(url_categories) - stored, ledger.average_size())
     
     # Save a list of all URLs to download for resume capability
     with open("all_downloads.json", "w", encoding="utf-8") as f:
@@ -357,14 +584,19 @@ async def main():
             return
     
     # Configure connection settings for better performance
-    conn = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, ssl=False)
-    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    conn = aiohttp.TCPConnector(limit=MAX_CONCURRENCY_LIMIT, ssl=False)
+    # No total timeout, stream_to_file aborts the downloads that stall instead
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT, sock_read=STALL_WINDOW)
     
-    # Create a semaphore to limit concurrent requests
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    # Concurrency grows while the server keeps up and backs off on 429/5xx or rising latency
+    limiter = AdaptiveLimiter(initial=MAX_CONCURRENT_REQUESTS, minimum=MIN_CONCURRENT_REQUESTS,
+                              maximum=MAX_CONCURRENCY_LIMIT, name='downloads')
     
+    # Pauses new downloads when the disk runs short instead of filling it
+    budget = DiskBudget(FILES_DIR, estimate=ledger.average_size())
+
     # Create progress bar
-    pbar = tqdm_asyncio(total=total_links, desc="Downloading files")
+    pbar = tqdm_asyncio(total=len(url_categories), desc="Downloading files")
     
     results = {"success": 0, "failed": 0, "errors": []}
     
@@ -388,14 +620,15 @@ async def main():
                 'Upgrade-Insecure-Requests': '1'
             }
         ) as session:
+        if not await verify_session(session):
+            await refresh_session(session, broker, generation)
+
+        reporter = asyncio.create_task(limiter.report_every(REPORT_INTERVAL))
+
         # Create tasks for each category and URL
         tasks = []
-        for category, links in all_links.items():
-            # Start with a small subset for testing
-            links_set = set(links)  # Remove duplicates
-            for url in links_set:
-                if url and url.strip():  # Ensure URL is not empty
-                    tasks.append(download_file(session, url, FILES_DIR, category, pbar, semaphore))
+        for url, categories in url_categories.items():
+            tasks.append(download_recorded(ledger, session, url, categories, pbar, limiter, broker, store, budget))
         
         # Process tasks as they complete
         for future in asyncio.as_completed(tasks):
@@ -414,6 +647,9 @@ async def main():
             if (results["success"] + results["failed"]) % 100 == 0:
                 success_rate = results["success"] / (results["success"] + results["failed"]) * 100
                 print(f"\nProgress: {results['success']} success, {results['failed']} failed ({success_rate:.1f}% success rate)")
+
+        reporter.cancel()
+        print(limiter.describe())
     
     # Show final stats
     print(f"\nDownload complete. Success: {results['success']}, Failed: {results['failed']}")
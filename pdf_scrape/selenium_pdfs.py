@@ -10,13 +10,17 @@ from tqdm import tqdm
 from urllib.parse import unquote
 import sys
 import multiprocessing
-from functools import partial
 import random
-import math
+import queue
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from login import login
-from utils import create_driver, save_cookies
+from session_broker import SessionBroker
+from file_store import FileStore, file_digest, group_urls
+from ledger import Ledger
+from disk_budget import DiskBudget, preflight
+from utils import create_driver, is_logged_in, load_cookies
+from drivers import DriverPool, driver_path
+import metrics
 from pdfs import get_all_links
 
 # Define constants with absolute paths
@@ -24,7 +28,16 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 FILES_DIR = os.path.join(SCRIPT_DIR, 'Files')
 INPUT_DIR = os.path.join(SCRIPT_DIR, 'Scraped')
 BASE_URL = "https://eprm.ypen.gr/src/App/"
-GLOBAL_PROGRESS_FILE = os.path.join(SCRIPT_DIR, "global_progress.json")
+
+STAGING_DIR = os.path.join(FILES_DIR, '.staging')
+DOWNLOAD_TIMEOUT = 30        # Seconds to wait for a download without any progress
+POLL_INTERVAL = 0.2          # Seconds between two reads of the download events
+TEMP_SUFFIXES = ('.crdownload', '.tmp')
+
+BATCH_SIZE = 5               # Urls a worker takes from the queue at a time
+RESULT_POLL = 5              # Seconds between two checks for dead workers while waiting for results
+SPARE_DRIVERS = 0            # Drivers each worker keeps started in advance to replace a broken one at once
+MAX_RESTARTS = 10            # Workers started in total to replace the ones that died
 
 # Make sure the FILES_DIR exists
 os.makedirs(FILES_DIR, exist_ok=True)
@@ -44,264 +57,394 @@ def wait_for_internet():
         time.sleep(10)  # Check every 10 seconds
     print("Internet connection restored!")
 
-def wait_for_download_complete(download_dir, expected_name=None, timeout=30, poll_interval=1):
+class DownloadWatcher:
     """
-    Wait for download to complete by monitoring for new files in the directory.
-    This version doesn't rely on temporary files.
-    
-    Args:
-        download_dir: Directory to monitor for new files
-        expected_name: Optional name pattern to look for
-        timeout: Maximum time to wait in seconds
-        poll_interval: How often to check in seconds
-        
-    Returns:
-        True if new files are detected, False otherwise
+    Follows the downloads of one driver into its own staging directory.
+
+    Chrome reports every download as Page.downloadWillBegin/downloadProgress events with a
+    guid, which the driver keeps in its performance log. A download is complete when its
+    guid reaches the 'completed' state, and its file is the suggested filename in the
+    staging directory. Since nothing else writes to that directory, a finished file there
+    is taken as the download too when the events aren't available.
     """
-    # Get initial directory listing
-    initial_files = set(os.listdir(download_dir))
-    
-    start_time = time.time()
-    max_time = start_time + timeout
-    
-    # Monitor for new files
-    while time.time() < max_time:
-        time.sleep(poll_interval)
-        current_files = set(os.listdir(download_dir))
-        new_files = current_files - initial_files
-        
-        if new_files:
-            if expected_name:
-                # Check if any of the new files match the expected name
-                matching_files = [f for f in new_files if expected_name.lower() in f.lower()]
-                if matching_files:
-                    return True
-                # If no matching file, but we have new files, consider it a success anyway
-                return True
-            else:
-                # No specific name expected, just return True on any new file
-                return True
-                
-    # If we've gone through the full timeout without finding new files
-    return False
-
-def load_global_progress():
-    """Load the global progress data from the JSON file"""
-    if os.path.exists(GLOBAL_PROGRESS_FILE):
+
+    def __init__(self, staging_dir):
+        self.staging_dir = staging_dir
+        os.makedirs(staging_dir, exist_ok=True)
+
+    def reset(self, driver):
+        """Forget the events and files of earlier downloads, before starting a new one"""
+        self.events(driver)
+        for name in os.listdir(self.staging_dir):
+            try:
+                os.remove(os.path.join(self.staging_dir, name))
+            except OSError:
+                pass
+
+    def events(self, driver):
+        """The download events logged since the previous call"""
         try:
-            with open(GLOBAL_PROGRESS_FILE, "r", encoding="utf-8") as f:
-                return set(json.load(f))
-        except:
-            print("Warning: Failed to load global progress file. Starting fresh.")
-    return set()
-
-def update_global_progress(completed_files, progress_lock):
-    """Update the global progress file with newly completed files"""
-    with progress_lock:
-        # Load current progress
-        current_progress = load_global_progress()
-        
-        # Add new completed files
-        updated_progress = current_progress.union(completed_files)
-        
-        # Save back to file
-        with open(GLOBAL_PROGRESS_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(updated_progress), f)
-
-def check_file_exists(category, filename):
-    """Check if a file already exists in the category directory"""
-    category_dir = os.path.join(FILES_DIR, category)
-    if not os.path.exists(category_dir):
-        return False
-    
-    # Try exact match first
-    if os.path.exists(os.path.join(category_dir, filename)):
+            entries = driver.get_log('performance')
+        except Exception:
+            return []
+
+        events = []
+        for entry in entries:
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            if message.get('method', '').split('.')[-1] in ('downloadWillBegin', 'downloadProgress'):
+                events.append(message)
+        return events
+
+    def finished_file(self, sizes=None):
+        """
+        A file in the staging directory that isn't a Chrome temporary, and that stopped
+        growing since the previous call if sizes is given.
+        """
+        for name in os.listdir(self.staging_dir):
+            if name.endswith(TEMP_SUFFIXES):
+                continue
+            if sizes is None:
+                return name
+            size = os.path.getsize(os.path.join(self.staging_dir, name))
+            if sizes.get(name) == size:
+                return name
+            sizes[name] = size
+        return None
+
+    def wait(self, driver, timeout=DOWNLOAD_TIMEOUT):
+        """
+        Wait for the download started by the last driver.get.
+
+        Returns:
+        - str: name of the downloaded file in the staging directory, None on a timeout or a cancelled download
+        """
+        names = {}
+        completed = None
+        sizes = {}
+        deadline = time.time() + timeout
+        last_progress = time.time()
+
+        while time.time() < deadline:
+            for event in self.events(driver):
+                params = event.get('params', {})
+                if event['method'].endswith('downloadWillBegin'):
+                    names[params.get('guid')] = params.get('suggestedFilename')
+                elif params.get('state') == 'completed':
+                    completed = params.get('guid')
+                elif params.get('state') == 'canceled':
+                    return None
+                else:
+                    # Still receiving bytes, a long download isn't a stalled one
+                    last_progress = time.time()
+                    deadline = max(deadline, last_progress + timeout)
+
+            if completed is not None:
+                name = names.get(completed)
+                if name and os.path.exists(os.path.join(self.staging_dir, name)):
+                    return name
+                # Chrome may have renamed the file, it is the only one there
+                name = self.finished_file()
+                if name:
+                    return name
+
+            if not names:
+                # No events from this driver, watch the directory instead
+                name = self.finished_file(sizes)
+                if name:
+                    return name
+
+            time.sleep(POLL_INTERVAL)
+        return None
+
+def check_file_exists(category, filename, ledger, listings):
+    """
+    Check if a file already exists in the category directory, ignoring case.
+
+    Looks the file up in the ledger, then in one listing of the directory per category
+    kept in listings, instead of listing the directory for every file.
+    """
+    if ledger.has_file(category, filename):
         return True
-    
-    # Try case-insensitive match (helpful for some systems)
-    filename_lower = filename.lower()
-    for existing_file in os.listdir(category_dir):
-        if existing_file.lower() == filename_lower:
-            return True
-    
-    return False
 
-def download_pdf_chunk(chunk_id, links_chunk, progress_lock):
-    """Download a chunk of PDFs with a dedicated driver"""
-    # Configure a new driver instance for this process
-    try:
-        print(f"Worker {chunk_id} starting...")
-        login(only_login=True)  
-        driver = create_driver('https://eprm.ypen.gr/')
-        save_cookies(driver)
-    except Exception as e:
-        print(f"Worker {chunk_id} failed to initialize: {str(e)}")
-        return 0, 0
-    
-    # Configure Chrome download settings
-    if "chrome" in driver.capabilities['browserName'].lower():
+    if category not in listings:
+        category_dir = os.path.join(FILES_DIR, category)
+        listings[category] = {name.lower() for name in os.listdir(category_dir)} if os.path.exists(category_dir) else set()
+    return filename.lower() in listings[category]
+
+def move_download(path, folder):
+    """
+    Move a finished download into folder without replacing a file of another download,
+    numbering the name like Chrome does, e.g. "file (1).pdf".
+
+    Returns:
+    - str: the name of the file in folder
+    """
+    name = os.path.basename(path)
+    stem, ext = os.path.splitext(name)
+    number = 0
+    while True:
+        try:
+            # A hardlink fails instead of replacing a file another worker just moved there
+            os.link(path, os.path.join(folder, name))
+            break
+        except FileExistsError:
+            number += 1
+            name = f"{stem} ({number}){ext}"
+    os.remove(path)
+    return name
+
+def open_session_driver(broker, download_dir=FILES_DIR):
+    """
+    Start a driver with the cookies of the shared session, asking the broker for a new
+    session once if they have expired. Its downloads are saved in download_dir.
+
+    Returns:
+    - (driver, generation) with driver None if it could not be created
+    """
+    generation, cookies = broker.cookies()
+    driver = create_driver('https://eprm.ypen.gr/', cookies=cookies, performance_log=True)
+    if driver and not is_logged_in(driver):
+        generation, cookies = broker.refresh(generation)
+        load_cookies(driver, 'https://eprm.ypen.gr/', cookies)
+
+    if driver and "chrome" in driver.capabilities['browserName'].lower():
+        # Configure Chrome download settings
         driver.command_executor._commands["send_command"] = (
             "POST", '/session/$sessionId/chromium/send_command')
-        params = {
+        driver.execute("send_command", {
             'cmd': 'Page.setDownloadBehavior',
-            'params': {'behavior': 'allow', 'downloadPath': os.path.abspath(FILES_DIR)}
-        }
-        driver.execute("send_command", params)
-    
-    # Track progress for resuming - using the global progress file
+            'params': {'behavior': 'allow', 'downloadPath': os.path.abspath(download_dir)}
+        })
+    return driver, generation
+
+def download_one(worker_id, pool, watcher, budget, category, url, ledger, store, listings, progress_lock):
+    """
+    Download one url with a driver leased from the worker's pool into its staging directory,
+    then move it into the category folder. Waits first while the disk is short of space.
+
+    Returns:
+    - (ok, message)
+    """
+    category_dir = os.path.join(FILES_DIR, category)
     with progress_lock:
-        completed_files = load_global_progress()
-    
-    print(f"Worker {chunk_id} found {len(completed_files)} already completed downloads")
-                
-    success_count = 0
-    error_count = 0
-    error_log = []
-    newly_completed = set()
-
-    for category, links in links_chunk.items():
-        category_dir = os.path.join(FILES_DIR, category)
-        with progress_lock:
-            os.makedirs(category_dir, exist_ok=True)
-
-        for url in links:
-            file_id = f"{category}/{url}"
-            
-            # Check if this file is in the global progress
-            if file_id in completed_files:
+        os.makedirs(category_dir, exist_ok=True)
+
+    # Check if this file is in the ledger, e.g. a re-queued item that was already done
+    if ledger.is_done(category, url):
+        return True, f"Already done: {category}/{url}"
+
+    # Extract expected filename from URL
+    expected_name = unquote(url.split('/')[-1].split('?')[0])
+
+    # Already downloaded for another category or run, link it instead of downloading again
+    entry = store.lookup(url)
+    if entry:
+        store.link(entry['sha256'], os.path.join(category_dir, entry['filename']))
+        ledger.mark_done(category, url, entry['filename'], entry['size'])
+        return True, f"Linked from store: {category}/{entry['filename']}"
+
+    # Double check if file already physically exists
+    if check_file_exists(category, expected_name, ledger, listings):
+        # File exists but wasn't in the ledger
+        ledger.mark_done(category, url, expected_name)
+        return True, f"File already exists: {category}/{expected_name}"
+
+    # The downloads of the other workers finish meanwhile, this one waits for space to be freed
+    budget.wait_for_room_blocking()
+    ledger.mark_started(category, url)
+
+    while True:  # Retry loop for internet recovery
+        try:
+            # Start the download
+            start = time.perf_counter()
+            with pool.lease() as driver:
+                watcher.reset(driver)
+                full_url = BASE_URL + url
+                driver.get(full_url)
+
+                # Wait for Chrome to report the download as completed
+                downloaded_file = watcher.wait(driver)
+            if not downloaded_file:
+                ledger.mark_failed(category, url, "Timeout")
+                return False, f"Timeout: {category}/{expected_name}"
+
+            # Move it into its category and keep the content once in the store
+            downloaded_file = move_download(os.path.join(watcher.staging_dir, downloaded_file), category_dir)
+            downloaded_path = os.path.join(category_dir, downloaded_file)
+            store.adopt(downloaded_path, file_digest(downloaded_path), url)
+            metrics.observe('download_seconds', time.perf_counter() - start, downloader='selenium')
+            metrics.inc('download_bytes_total', os.path.getsize(downloaded_path), downloader='selenium')
+
+            ledger.mark_done(category, url, downloaded_file, os.path.getsize(downloaded_path))
+            return True, f"Downloaded: {category}/{downloaded_file}"
+
+        except WebDriverException as e:
+            # The pool has quit the broken driver, the next lease gets a new one
+            wait_for_internet()
+
+            if "net::ERR_INTERNET_DISCONNECTED" in str(e):
+                print(f"Worker {worker_id} - Connection lost during download - will retry...")
+                metrics.inc('download_retries_total', downloader='selenium')
+                time.sleep(5)
                 continue
+            ledger.mark_failed(category, url, e)
+            return False, f"Error: {category}/{url} - {str(e)}"
+        except Exception as e:
+            ledger.mark_failed(category, url, e)
+            return False, f"Error: {category}/{url} - {str(e)}"
 
-            # Extract expected filename from URL
-            expected_name = unquote(url.split('/')[-1].split('?')[0])
-            
-            # Double check if file already physically exists
-            with progress_lock:
-                if check_file_exists(category, expected_name):
-                    # File exists but wasn't in our progress file
-                    completed_files.add(file_id)
-                    newly_completed.add(file_id)
-                    success_count += 1
-                    print(f"Worker {chunk_id} - File already exists: {category}/{expected_name}")
-                    continue
+def download_worker(worker_id, task_queue, result_queue, in_flight, progress_lock, broker):
+    """
+    Pull batches of (category, url) from task_queue until it hands out None, with drivers leased from its own pool.
 
-            while True:  # Retry loop for internet recovery
-                try:
-                    # Set download directory for this category
-                    if "chrome" in driver.capabilities['browserName'].lower():
-                        params['params']['downloadPath'] = os.path.abspath(category_dir)
-                        driver.execute("send_command", params)
-
-                    # Get a snapshot of files before download
-                    with progress_lock:
-                        initial_files = set(os.listdir(category_dir))
-                    
-                    # Start the download
-                    full_url = BASE_URL + url
-                    driver.get(full_url)
-                    
-                    # Wait for new files to appear (ignoring temporary files)
-                    if wait_for_download_complete(category_dir, expected_name):
-                        # Get the current files after download
-                        with progress_lock:
-                            current_files = set(os.listdir(category_dir))
-                        new_files = current_files - initial_files
-                        
-                        if new_files:
-                            # Use the first new file detected
-                            downloaded_file = list(new_files)[0]
-                            success_count += 1
-                            
-                            # Add to local tracking sets
-                            completed_files.add(file_id)
-                            newly_completed.add(file_id)
-                            
-                            # Update global progress periodically (every 5 downloads)
-                            if len(newly_completed) >= 5:
-                                update_global_progress(newly_completed, progress_lock)
-                                newly_completed = set()
-                                
-                            print(f"Worker {chunk_id} - Downloaded: {category}/{downloaded_file}")
-                            break  # Exit retry loop on success
-                        else:
-                            error_log.append(f"No new files found for: {category}/{expected_name}")
-                            error_count += 1
-                            break
-                    else:
-                        error_log.append(f"Timeout: {category}/{expected_name}")
-                        error_count += 1
-                        break
-
-                except WebDriverException as e:
-                    wait_for_internet()  
-                    login(only_login=True)  # Re-login if needed
-                    driver = create_driver('https://eprm.ypen.gr/')
-                    save_cookies(driver)
-                    
-                    if "net::ERR_INTERNET_DISCONNECTED" in str(e):
-                        print(f"Worker {chunk_id} - Connection lost during download - will retry...")
-                        time.sleep(5)
-                        continue
-                    error_log.append(f"Error: {category}/{url} - {str(e)}")
-                    error_count += 1
-                    break
-                except Exception as e:
-                    error_log.append(f"Error: {category}/{url} - {str(e)}")
-                    error_count += 1
-                    break
-
-                # Add some random delay between downloads to avoid overwhelming the server
-                # time.sleep(random.uniform(0.5, 2.0))
-
-    # Update global progress with any remaining newly completed files
-    if newly_completed:
-        update_global_progress(newly_completed, progress_lock)
-
-    # Write any errors to a log file
-    if error_log:
-        with open(os.path.join(SCRIPT_DIR, f"download_errors_{chunk_id}.log"), "w", encoding="utf-8") as f:
-            f.write("\n".join(error_log))
-        print(f"Worker {chunk_id} - Errors logged: {len(error_log)}")
+    The batch being worked on is kept in in_flight[worker_id] so the main process can
+    re-queue it if this worker dies, and every item is reported on result_queue as
+    (worker_id, category, url, ok, message, metrics snapshot) as soon as it is done.
+    """
+    # Drivers of this process, downloading into its own directory. They re-login through
+    # the broker only if the shared session has expired
+    watcher = DownloadWatcher(os.path.join(STAGING_DIR, f"worker-{worker_id}"))
+    pool = DriverPool(lambda: open_session_driver(broker, watcher.staging_dir)[0],
+                      size=1 + SPARE_DRIVERS, spare=SPARE_DRIVERS)
+    try:
+        print(f"Worker {worker_id} starting...")
+        with pool.lease():
+            pass
+    except Exception as e:
+        print(f"Worker {worker_id} failed to initialize: {str(e)}")
+        pool.close()
+        return
+
+    store = FileStore(FILES_DIR)
+    budget = DiskBudget(FILES_DIR)
+
+    # Track progress for resuming - using the download ledger
+    ledger = Ledger()
+    listings = {}
+
+    while True:
+        batch = task_queue.get()
+        if batch is None:
+            break
+
+        in_flight[worker_id] = batch
+        for category, url in batch:
+            ok, message = download_one(worker_id, pool, watcher, budget, category, url,
+                                       ledger, store, listings, progress_lock)
+            print(f"Worker {worker_id} - {message}")
+            result_queue.put((worker_id, category, url, ok, message, metrics.drain()))
+        del in_flight[worker_id]
+
+    ledger.close()
 
     # Clean up
-    try:
-        driver.quit()
-    except:
-        pass
+    pool.close()
 
-    print(f"Worker {chunk_id} - Complete! Success: {success_count}, Errors: {error_count}")
-    return success_count, error_count
+    print(f"Worker {worker_id} - Complete!")
+
+def link_duplicates(url_categories, ledger):
+    """Give the other categories of every url a link to its stored file and mark them completed"""
+    store = FileStore(FILES_DIR)
+    linked = 0
+    for url, categories in url_categories.items():
+        entry = store.lookup(url)
+        if not entry:
+            continue
+        for category in categories[1:]:
+            store.link(entry['sha256'], os.path.join(FILES_DIR, category, entry['filename']))
+            ledger.mark_done(category, url, entry['filename'], entry['size'])
+            linked += 1
+
+    if linked:
+        print(f"Linked {linked} duplicate files from the store")
+
+def make_batches(all_links, batch_size=BATCH_SIZE):
+    """Shuffle the links of {category: [urls]} and cut them into small batches of (category, url)"""
+    flat_links = [(category, url) for category, urls in all_links.items() for url in urls]
 
-def split_links_for_parallel(all_links, num_workers):
-    """Split links dictionary into roughly equal chunks for parallel processing"""
-    # Flatten the dictionary into a list of (category, url) tuples
-    flat_links = []
-    for category, urls in all_links.items():
-        for url in urls:
-            flat_links.append((category, url))
-    
     # Shuffle the links to distribute load more evenly
     random.shuffle(flat_links)
-    
-    # Split into chunks
-    chunk_size = math.ceil(len(flat_links) / num_workers)
-    chunks = [flat_links[i:i + chunk_size] for i in range(0, len(flat_links), chunk_size)]
-    
-    # Convert chunks back to dictionary format
-    chunked_dicts = []
-    for chunk in chunks:
-        chunk_dict = {}
-        for category, url in chunk:
-            if category not in chunk_dict:
-                chunk_dict[category] = []
-            chunk_dict[category].append(url)
-        chunked_dicts.append(chunk_dict)
-    
-    return chunked_dicts
+    return [flat_links[i:i + batch_size] for i in range(0, len(flat_links), batch_size)]
+
+def start_worker(worker_id, task_queue, result_queue, in_flight, progress_lock, broker):
+    worker = multiprocessing.Process(target=download_worker, name=f"download-worker-{worker_id}",
+                                     args=(worker_id, task_queue, result_queue, in_flight, progress_lock, broker))
+    worker.start()
+    return worker
+
+def run_workers(batches, num_workers, progress_lock, broker, manager):
+    """
+    Let num_workers processes pull the batches from a shared queue and stream back their results.
+
+    A worker that dies has the items of its unfinished batch put back in the queue and is
+    replaced, up to MAX_RESTARTS times in total.
+
+    Returns:
+    - dict: {(category, url): (ok, message)} of every item that got a result
+    """
+    task_queue = manager.Queue()
+    result_queue = manager.Queue()
+    in_flight = manager.dict()
+    for batch in batches:
+        task_queue.put(batch)
+
+    pending = {item for batch in batches for item in batch}
+    results = {}
+    workers = {i: start_worker(i, task_queue, result_queue, in_flight, progress_lock, broker) for i in range(num_workers)}
+    next_id = num_workers
+    restarts = 0
+    success = 0
+
+    while pending and workers:
+        try:
+            worker_id, category, url, ok, message, snapshot = result_queue.get(timeout=RESULT_POLL)
+        except queue.Empty:
+            # Re-queue the unfinished items of the workers that died and replace them
+            for worker_id, worker in list(workers.items()):
+                if worker.is_alive():
+                    continue
+                del workers[worker_id]
+                lost = [item for item in in_flight.pop(worker_id, []) if item in pending]
+                if lost:
+                    task_queue.put(lost)
+                    print(f"Worker {worker_id} died (exit code {worker.exitcode}), re-queued {len(lost)} items")
+                if restarts < MAX_RESTARTS:
+                    restarts += 1
+                    workers[next_id] = start_worker(next_id, task_queue, result_queue, in_flight, progress_lock, broker)
+                    next_id += 1
+            continue
+
+        metrics.merge(snapshot)
+        if (category, url) not in pending:
+            continue
+        metrics.inc('downloads_total', downloader='selenium', result='ok' if ok else 'failed')
+        pending.discard((category, url))
+        results[(category, url)] = (ok, message)
+        success += ok
+
+        done = len(results)
+        if done % 10 == 0 or not pending:
+            print(f"Progress: {done}/{done + len(pending)} ({success} success, {done - success} errors)")
+
+    if pending:
+        print(f"No workers left, {len(pending)} items were not downloaded")
+
+    # Let the remaining workers finish their current batch and exit
+    for _ in workers:
+        task_queue.put(None)
+    for worker in workers.values():
+        worker.join()
+
+    return results
 
 def main(num_workers=1):
     print(f"Script directory: {SCRIPT_DIR}")
     print(f"Files directory: {FILES_DIR}")
     print(f"Starting download with {num_workers} parallel workers")
+    metrics.start('selenium_pdfs')
     
     # Get all links first
     all_links, _ = get_all_links()
@@ -309,9 +452,10 @@ def main(num_workers=1):
     
     print(f"Found {total_links} files to download across {len(all_links)} categories.")
     
-    # Check existing files and update global progress
-    initial_progress = load_global_progress()
-    print(f"Found {len(initial_progress)} entries in global progress file")
+    # Check the ledger, global_progress.json is imported into it on first use
+    ledger = Ledger()
+    initial_progress = ledger.done_keys()
+    print(f"Found {len(initial_progress)} completed downloads in the ledger")
     
     if total_links > 1000:
         confirm = input(f"WARNING: You're about to download {total_links} files. Continue? (y/n): ")
@@ -319,13 +463,12 @@ def main(num_workers=1):
             print("Download cancelled.")
             return
     
-    # Filter out links that are already in the global progress
+    # Filter out links that are already in the ledger
     filtered_links = {}
     for category, urls in all_links.items():
         filtered_links[category] = []
         for url in urls:
-            file_id = f"{category}/{url}"
-            if file_id not in initial_progress:
+            if (category, url) not in initial_progress:
                 filtered_links[category].append(url)
     
     remaining_links = sum(len(links) for links in filtered_links.values())
@@ -335,34 +478,44 @@ def main(num_workers=1):
         print("All files have already been downloaded. Nothing to do!")
         return
     
-    # Split links into chunks for parallel processing
-    link_chunks = split_links_for_parallel(filtered_links, num_workers)
+    # Download every url once, in the first category it appears in
+    url_categories = group_urls(filtered_links)
+    unique_links = {}
+    for url, categories in url_categories.items():
+        unique_links.setdefault(categories[0], []).append(url)
+    print(f"{len(url_categories)} unique urls to download")
+    preflight(FILES_DIR, len(url_categories), ledger.average_size())
+
+    # Small batches the workers pull from a shared queue as they become free
+    batches = make_batches(unique_links)
     
-    # Create a manager for sharing the lock between processes
+    # Create a manager for sharing the lock and the session between processes
     with multiprocessing.Manager() as manager:
-        # Create a lock for directory operations and progress file updates
+        # Create a lock for directory operations
         progress_lock = manager.Lock()
-        
-        # Create and start worker processes
-        with multiprocessing.Pool(processes=num_workers) as pool:
-            download_func = partial(download_pdf_chunk, progress_lock=progress_lock)
-            results = pool.starmap(download_func, enumerate(link_chunks))
+
+        # Resolve chromedriver once, the workers inherit its path
+        driver_path()
+
+        # Log in once here, the workers share the cookies and ask for a re-login through the broker
+        with SessionBroker(manager) as broker:
+            # Create and start worker processes
+            results = run_workers(batches, num_workers, progress_lock, broker, manager)
+
+        # Link the urls shared by several categories to the file the workers stored
+        link_duplicates(url_categories, ledger)
     
     # Process results
-    total_success = sum(r[0] for r in results)
-    total_errors = sum(r[1] for r in results)
+    total_success = sum(1 for ok, _ in results.values() if ok)
+    total_errors = len(results) - total_success
+    total_urls = len(url_categories)
     
     print(f"\nAll workers completed!")
-    print(f"Total success: {total_success}/{remaining_links} ({(total_success/remaining_links)*100:.1f}%)")
+    print(f"Total success: {total_success}/{total_urls} ({(total_success/total_urls)*100:.1f}%)")
     print(f"Total errors: {total_errors}")
     
     # Combine error logs
-    combined_errors = []
-    for i in range(num_workers):
-        error_log_path = os.path.join(SCRIPT_DIR, f"download_errors_{i}.log")
-        if os.path.exists(error_log_path):
-            with open(error_log_path, "r", encoding="utf-8") as f:
-                combined_errors.extend(f.readlines())
+    combined_errors = [f"{message}\n" for ok, message in results.values() if not ok]
     
     if combined_errors:
         with open(os.path.join(SCRIPT_DIR, "download_errors_combined.log"), "w", encoding="utf-8") as f:
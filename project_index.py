@@ -0,0 +1,273 @@
+"""
+Index of the projects in the Scraped/<tab>.json files, to find them without grepping the files.
+
+    python project_index.py --pet 2410007617
+    python project_index.py --status "Τελική αξιολόγηση" --place Θεσσαλία
+    python project_index.py --company ΔΕΗ --since 2024-01-01 --until 2024-12-31 --json
+
+Projects can be looked up by PET, by status (the values of "Κατάσταση αίτησης"), by
+any level of their administrative hierarchy, by submission date range and by company
+name. Filters are combined with AND. Every filter answers from a posting list or a
+sorted date list, the text filters match a substring of the indexed names, so they only
+scan the distinct names and never the projects.
+
+INDEX_FILE keeps the posting lists with the mtime and size of every tab file, and
+SUMMARY_FILE one line per project, read from its offset only for the projects returned.
+Loading the index is a single small unpickle, and only the tab files that changed since
+are read again.
+"""
+import argparse
+import json
+import os
+import pickle
+import sys
+import unicodedata
+from bisect import bisect_left, bisect_right
+
+from loggers import *
+from pdf_scrape.link_manifest import iter_projects
+
+
+SCRAPED_DIR = "Scraped"
+INDEX_FILE = os.path.join(SCRAPED_DIR, "project_index.pkl")       # Posting lists, rebuilt when a tab file changed
+SUMMARY_FILE = os.path.join(SCRAPED_DIR, "project_index.jsonl")   # One JSON list per project, in FIELDS order
+INDEX_VERSION = 1
+SKIPPED_FILES = {"tabs.json"}
+
+# Columns of the summary kept for every project
+FIELDS = ('key', 'tab', 'pet', 'title', 'status', 'submitted', 'company', 'location', 'hierarchies')
+
+
+def normalize(text):
+    """Case and accent insensitive form of a name, e.g. 'Θεσσαλία' and 'ΘΕΣΣΑΛΙΑΣ' share 'θεσσαλια'"""
+    decomposed = unicodedata.normalize('NFD', text or '')
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).casefold().split())
+
+
+def project_summary(key, panels, tab):
+    """The indexed fields of one project, a list in the order of FIELDS"""
+    application = panels.get('panel-application_info', {})
+    location = panels.get('panel-location', {})
+    status = application.get('Κατάσταση αίτησης') or []
+    return [
+        key,
+        tab,
+        application.get('ΠΕΤ') or key.split('_')[0],
+        application.get('Τίτλος Έργου ή Δραστηριότητας'),
+        status if isinstance(status, list) else [status],
+        application.get('Ημερομηνία υποβολής') or None,
+        panels.get('panel-company_info', {}).get('Επωνυμία'),
+        location.get('location_name'),
+        location.get('administrative_hierarchies') or [],
+    ]
+
+
+def read_tab(path, tab):
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    return [project_summary(key, panels, tab) for key, panels in iter_projects(text)]
+
+
+def _post(postings, name, i):
+    if name:
+        postings.setdefault(normalize(name), []).append(i)
+
+
+class ProjectIndex:
+    """
+    Posting lists of the projects of the tab files, a project is its line in SUMMARY_FILE.
+
+    - sources: {filename: {mtime, size, count}}, the projects of a file follow the ones
+      of the files sorted before it
+    - offsets: byte offset of every project in SUMMARY_FILE
+    - by_pet, by_tab, by_status, by_place, by_company: {normalized value: [projects]}
+    - dates, date_ids: submission dates sorted, and the project of each, for ranges by bisection
+    """
+
+    def __init__(self, input_dir=SCRAPED_DIR, path=INDEX_FILE, summary_path=SUMMARY_FILE):
+        self.input_dir = os.path.abspath(input_dir)
+        self.path = path
+        self.summary_path = summary_path
+        self.sources = {}
+        self.build([])
+
+    @classmethod
+    def open(cls, input_dir=SCRAPED_DIR, path=INDEX_FILE, summary_path=SUMMARY_FILE):
+        """The index of input_dir saved in path, brought up to date with the tab files"""
+        index = cls(input_dir, path, summary_path)
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            state = {}
+        # Made for another Scraped/ directory or an older layout, start over
+        if (state.get('version') == INDEX_VERSION and state.get('input_dir') == index.input_dir
+                and os.path.exists(summary_path)):
+            index.__dict__.update(state['index'])
+        index.refresh()
+        return index
+
+    def save(self):
+        # Plain containers only, so the file loads the same from the CLI and from an import
+        state = {name: value for name, value in self.__dict__.items()
+                 if name not in ('input_dir', 'path', 'summary_path')}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': INDEX_VERSION, 'input_dir': self.input_dir, 'index': state}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Read again the tab files that changed and save the index, returns their names"""
+        filenames = sorted(filename for filename in os.listdir(self.input_dir)
+                           if filename.endswith('.json') and filename not in SKIPPED_FILES)
+        changed = {}
+        for filename in filenames:
+            path = os.path.join(self.input_dir, filename)
+            stat = os.stat(path)
+            entry = self.sources.get(filename)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            try:
+                changed[filename] = (stat, read_tab(path, filename[:-len('.json')]))
+            except Exception as e:
+                log_error(f"Failed to index {path}: {e}")
+
+        removed = set(self.sources) - set(filenames)
+        if not changed and not removed:
+            return []
+
+        # The unchanged files keep the summaries they have in SUMMARY_FILE
+        summaries = {}
+        start = 0
+        for filename in sorted(self.sources):
+            count = self.sources[filename]['count']
+            if filename not in changed and filename not in removed:
+                summaries[filename] = list(self.summaries(range(start, start + count)))
+            start += count
+        for filename, (stat, projects) in changed.items():
+            summaries[filename] = projects
+            self.sources[filename] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'count': len(projects)}
+        for filename in removed:
+            del self.sources[filename]
+
+        self.build([project for filename in sorted(summaries) for project in summaries[filename]])
+        self.save()
+        log_info(f"Indexed {len(self.offsets)} projects, read again: {', '.join(sorted(changed) + sorted(removed))}")
+        return sorted(changed) + sorted(removed)
+
+    def build(self, projects):
+        """Write SUMMARY_FILE and the posting lists of projects"""
+        self.offsets = []
+        self.by_pet, self.by_tab, self.by_status, self.by_place, self.by_company = {}, {}, {}, {}, {}
+        dated = []
+        if projects:
+            tmp_path = self.summary_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for project in projects:
+                    self.offsets.append(f.tell())
+                    f.write(json.dumps(project, ensure_ascii=False).encode('utf-8') + b'\n')
+            os.replace(tmp_path, self.summary_path)
+
+        for i, (key, tab, pet, title, status, submitted, company, location, hierarchies) in enumerate(projects):
+            _post(self.by_pet, pet, i)
+            _post(self.by_tab, tab, i)
+            for step in status:
+                _post(self.by_status, step, i)
+            for place in {name for hierarchy in hierarchies for name in hierarchy}:
+                _post(self.by_place, place, i)
+            _post(self.by_company, company, i)
+            if submitted:
+                dated.append((submitted, i))
+        dated.sort()
+        self.dates = [sys.intern(submitted) for submitted, _ in dated]
+        self.date_ids = [i for _, i in dated]
+
+    def summaries(self, ids):
+        """The FIELDS lists of the projects ids, read from their offsets in SUMMARY_FILE"""
+        with open(self.summary_path, 'rb') as f:
+            for i in ids:
+                f.seek(self.offsets[i])
+                yield json.loads(f.readline())
+
+    @staticmethod
+    def _match(postings, text, exact=False):
+        """Projects whose value is text, or contains it unless exact"""
+        text = normalize(text)
+        if exact:
+            return set(postings.get(text, ()))
+        return {i for name, ids in postings.items() if text in name for i in ids}
+
+    def between(self, since=None, until=None):
+        """
+        Projects submitted in a date range.
+
+        Parameters:
+        - since, until: 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS', both included, None for no bound
+        """
+        start = bisect_left(self.dates, since) if since else 0
+        # A bare date includes the whole day
+        end = bisect_right(self.dates, until + ' 99' if until and len(until) == 10 else until) if until else len(self.dates)
+        return set(self.date_ids[start:end])
+
+    def query(self, pet=None, status=None, place=None, company=None, since=None, until=None, tab=None, limit=None):
+        """
+        Projects matching every filter given, in tab and listing order.
+
+        Returns:
+        - list: dicts with the keys of FIELDS
+        """
+        candidates = []
+        if pet:
+            candidates.append(self._match(self.by_pet, pet, exact=True))
+        if tab:
+            candidates.append(self._match(self.by_tab, tab.replace('/', '_'), exact=True))
+        if status:
+            candidates.append(self._match(self.by_status, status))
+        if place:
+            candidates.append(self._match(self.by_place, place))
+        if company:
+            candidates.append(self._match(self.by_company, company))
+        if since or until:
+            candidates.append(self.between(since, until))
+
+        if candidates:
+            ids = sorted(set.intersection(*sorted(candidates, key=len)))
+        else:
+            ids = range(len(self.offsets))
+        if limit:
+            ids = ids[:limit]
+        return [dict(zip(FIELDS, project)) for project in self.summaries(ids)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find scraped projects by PET, status, place, company and submission date")
+    parser.add_argument('--pet', help="PET of the project")
+    parser.add_argument('--status', help='a value of "Κατάσταση αίτησης", or part of it')
+    parser.add_argument('--place', help="region, regional unit, municipality or municipal unit, or part of its name")
+    parser.add_argument('--company', help="part of the company name")
+    parser.add_argument('--since', help="submitted on or after, YYYY-MM-DD")
+    parser.add_argument('--until', help="submitted on or before, YYYY-MM-DD")
+    parser.add_argument('--tab', help="only this tab, e.g. w7_view")
+    parser.add_argument('--limit', type=int, help="print at most this many projects")
+    parser.add_argument('--json', action='store_true', help="print one JSON object per project")
+    parser.add_argument('--rebuild', action='store_true', help="read every tab file again")
+    args = parser.parse_args()
+
+    if args.rebuild and os.path.exists(INDEX_FILE):
+        os.remove(INDEX_FILE)
+    index = ProjectIndex.open()
+    results = index.query(args.pet, args.status, args.place, args.company, args.since, args.until, args.tab, args.limit)
+
+    for project in results:
+        if args.json:
+            print(json.dumps(project, ensure_ascii=False))
+        else:
+            region = project['hierarchies'][0][0] if project['hierarchies'] else ''
+            print(f"{project['key']}\t{project['submitted'] or ''}\t{project['company'] or ''}\t{region}\t{project['title'] or ''}")
+    if not args.json:
+        print(f"{len(results)} projects shown, {len(index.offsets)} indexed")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,10 @@ import requests
 from all_tabs import known_tabs
 from id import * 
 from loggers import * 
+from utils import create_http_session, load_cookie_dict
+from parsers import extract_project_panels
+from jsonl_store import JsonlWriter, compact_jsonl, jsonl_keys, stream_path
+from crawl import crawl_projects, fetch_listing_rows, MAX_IN_FLIGHT, LISTING_PAGE_LENGTH
 from bs4 import BeautifulSoup
 from selenium.webdriver.support.ui import Select
 from selenium.webdriver.support.ui import WebDriverWait
@@ -9,7 +13,11 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 import re
+import os
 import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import metrics
 
 
 def is_public_view(tab):
@@ -17,6 +25,19 @@ def is_public_view(tab):
 
 BASE_URL  = 'https://eprm.ypen.gr/src/App/'
 
+# 'async' fetches all project pages of a tab concurrently with the saved cookies,
+# 'http' fetches them one at a time, 'selenium' renders every page in chrome
+FETCH_MODE = 'async'
+# 'endpoint' lists a tab from the json endpoint behind its datatable, 'selenium' clicks through the pages
+LISTING_MODE = 'endpoint'
+# Only scrape projects missing from Scraped/<tab>.json, paging stops after KNOWN_RUN known projects in a row
+INCREMENTAL = True
+KNOWN_RUN = 20
+INCREMENTAL_PAGE_LENGTH = 100
+HTTP_TIMEOUT = 30
+# Processes parsing the pages fetched by the async crawl, 1 parses on the event loop
+PARSE_WORKERS = os.cpu_count() or 1
+
 def scrape(driver):
     try:
         driver.get(BASE_URL)
@@ -78,7 +99,7 @@ def scrape(driver):
             
             print(f'Scraping tab: {tab}')
             # if not is_public_view(tab): continue
-            scrape_tab(driver , tab)
+            scrape_tab(driver , tab, incremental=INCREMENTAL)
             print('\n\n\n')
             # break # REMOVE
             
@@ -86,7 +107,145 @@ def scrape(driver):
          log_error(f"Error on scrape {e}")
 
 
-def scrape_tab(driver, tab):
+def scrape_tab(driver, tab, incremental=False):
+    try:
+        metrics.start('scrape')
+
+        # Listings are ordered by date, so the new projects are the ones before the known ones
+        existing = load_scraped(tab) if incremental else {}
+        known_keys = set(existing)
+        if known_keys:
+            log_info(f"Incremental scrape of tab {tab}: {len(known_keys)} projects already scraped")
+
+        with log_timing('list', tab=tab):
+            all_projects = None
+            if LISTING_MODE == 'endpoint':
+                all_projects = list_tab_endpoint(tab, known_keys)
+            if all_projects is None:
+                all_projects = list_tab_selenium(driver, tab, known_keys)
+        if not all_projects:
+            return []
+
+        new_projects = [project for project in all_projects if listing_key(project) not in known_keys]
+        if known_keys:
+            log_info(f"Found {len(new_projects)} new projects in tab {tab}")
+
+        # Projects already streamed by an interrupted run are not fetched again
+        path = output_path(tab)
+        stream = stream_path(path)
+        done_keys = jsonl_keys(stream)
+        if done_keys:
+            log_info(f"Resuming tab {tab}: {len(done_keys)} projects already in {stream}")
+        elif known_keys and not new_projects:
+            return []
+        to_fetch = [project for project in new_projects if listing_key(project) not in done_keys]
+
+        with JsonlWriter(stream) as writer, log_timing('crawl', tab=tab):
+            cookies = load_cookie_dict() if FETCH_MODE == 'async' else None
+            if cookies and PARSE_WORKERS > 1 and len(to_fetch) > 1:
+                with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as executor:
+                    asyncio.run(crawl_projects(to_fetch, tab, cookies, parse_project, limit=MAX_IN_FLIGHT,
+                                               sink=writer.write, executor=executor))
+            elif cookies:
+                asyncio.run(crawl_projects(to_fetch, tab, cookies, parse_project, limit=MAX_IN_FLIGHT, sink=writer.write))
+            else:
+                scrape_projects(driver, to_fetch, tab, sink=writer.write)
+
+        # New projects go first, like in the listing
+        compact_jsonl(stream, path, order=[listing_key(project) for project in new_projects], existing=existing)
+
+        print(f"Dictionary written to {path}")
+        log_info(f"Dictionary written to {path}")
+        return all_projects
+
+    except Exception as e:
+        log_error(f'Error on scrape tab {tab}: {e}')
+        return []
+
+
+def output_path(tab):
+    return f"Scraped/{tab.replace('/' , '_')}.json"
+
+
+def load_scraped(tab):
+    """Load the existing output of a tab, {} if the tab was never scraped"""
+    path = output_path(tab)
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except Exception as e:
+        log_error(f"Error loading {path}: {e}")
+        return {}
+
+
+def listing_key(project):
+    """Output key of a project from the listing"""
+    return project_key(project['pet'], f"https://eprm.ypen.gr{project['url']}")
+
+
+def known_run_length(projects, known_keys, run=0):
+    """Extend the current run of already scraped projects with the projects of one more page"""
+    for project in projects:
+        run = run + 1 if listing_key(project) in known_keys else 0
+    return run
+
+
+def list_tab_endpoint(tab, known_keys=None):
+    """List the projects of a tab from the datatable endpoint, None if the endpoint can't be used"""
+    cookies = load_cookie_dict()
+    if not cookies:
+        return None
+
+    is_public = is_public_view(tab)
+    stop = None
+    page_length = LISTING_PAGE_LENGTH
+    if known_keys:
+        run = 0
+        page_length = INCREMENTAL_PAGE_LENGTH
+
+        def stop(rows):
+            nonlocal run
+            run = known_run_length(scrape_page(None, rows_to_soup(rows), is_public=is_public), known_keys, run)
+            return run >= KNOWN_RUN
+
+    try:
+        listing = asyncio.run(fetch_listing_rows(f"{BASE_URL}{tab}", cookies, page_length=page_length, stop=stop))
+    except Exception as e:
+        log_error(f"Failed to list tab {tab} from the datatable endpoint: {e}")
+        return None
+
+    if listing is None:
+        return None
+
+    title, rows, total = listing
+    log_info(f'Scraping tab {tab} {title}...')
+    if total == 0:
+        log_info('No records in this tab: Continue...')
+        return []
+
+    all_projects = scrape_page(None, rows_to_soup(rows), is_public=is_public)
+    metrics.inc('listing_rows_total', len(all_projects), tab=tab)
+
+    if known_keys and len(all_projects) < total:
+        log_info(f"Stopped listing tab {tab} at {len(all_projects)} of {total} records after {KNOWN_RUN} known projects")
+    elif total != len(all_projects):
+        log_error(f"Missmatch in length of total {total} vs scraped {len(all_projects)} in this tab: {tab} , {title}")
+    else:
+        log_info(f"Correctly identified total projects : {len(all_projects)}")
+
+    return all_projects
+
+
+def rows_to_soup(rows):
+    """Rebuild the table body of the endpoint rows so that scrape_page parses them like the rendered page"""
+    body = ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in row) + '</tr>' for row in rows)
+    return BeautifulSoup(f'<table><tbody>{body}</tbody></table>', 'html.parser')
+
+
+def list_tab_selenium(driver, tab, known_keys=None):
     try:
         driver.get(f"{BASE_URL}/{tab}")
         
@@ -120,7 +279,9 @@ def scrape_tab(driver, tab):
         
         all_projects = []
         current_page = 1
+        run = 0
         global panel_set
+        page_start = time.perf_counter()
         while True:
             # Get fresh HTML after potential page reload
             page_html = driver.page_source
@@ -142,11 +303,22 @@ def scrape_tab(driver, tab):
             is_public  = is_public_view(tab)
             projects = scrape_page(driver, soup, is_public = is_public)
             all_projects.extend(projects)
+            metrics.inc('listing_rows_total', len(projects), tab=tab)
+            # From the previous page to this one parsed, including the wait for the table to reload
+            metrics.observe('listing_page_seconds', time.perf_counter() - page_start, tab=tab)
+            page_start = time.perf_counter()
 
             # Exit if last page (fewer than 100 projects)
             if len(projects) < 100:
                 break
 
+            # Exit once the rest of the listing was scraped in a previous run
+            if known_keys:
+                run = known_run_length(projects, known_keys, run)
+                if run >= KNOWN_RUN:
+                    log_info(f"Stopped listing tab {tab} at {len(all_projects)} of {total} records after {KNOWN_RUN} known projects")
+                    return all_projects
+
             # Click "Next" and wait for table to reload
             try:
                 next_button = WebDriverWait(driver, 10).until(
@@ -168,36 +340,47 @@ def scrape_tab(driver, tab):
             
         else:
             log_info(f"Correctly identified total projects : {len(all_projects)}")
-            
-        scraped = {}
-        c = -1
-        for project in all_projects:
-            c += 1
-            if c % 100 == 0:
-                log_info(f"Perccent completed for this tab {tab}: {c / len(all_projects) * 100:.2f}%")
-            
-            pet = project['pet']
-            
-            try:
-                scraped.update( scrape_project(pet , driver, f"https://eprm.ypen.gr{project['url']}", tab))
-                
-            except Exception as e:
-                log_error(f"Failed to scrape project from https://eprm.ypen.gr{project['url']}: {str(e)}")
-                
-        # Write to a JSON file
-        with open(f"Scraped/{tab.replace('/' , '_')}.json", "w") as file:
-            json.dump(scraped, file, indent=4, ensure_ascii=False)  # indent for pretty formatting
 
-        print(f"Dictionary written to Scraped/{tab.replace('/' , '_')}.json")
-        log_info(f"Dictionary written to Scraped/{tab.replace('/' , '_')}.json")
         return all_projects
 
     except Exception as e:
-        log_error(f'Error on scrape tab {tab}: {e}')
+        log_error(f'Error on listing tab {tab}: {e}')
         return []
-            
+
+
+def scrape_projects(driver, projects, tab, sink=None):
+    """
+    Scrape the project pages of a tab one at a time, over http when a session is available.
+
+    Each {key: panels} result is passed to sink as soon as it is parsed if one is given,
+    otherwise the results are collected and returned.
+    """
+    session = None
+    if FETCH_MODE in ('http', 'async'):
+        session = create_http_session()
+        if session is None:
+            log_error(f"No http session for tab {tab}, falling back to selenium")
+
+    scraped = {}
+    c = -1
+    for project in projects:
+        c += 1
+        if c % 100 == 0:
+            log_info(f"Perccent completed for this tab {tab}: {c / len(projects) * 100:.2f}%")
         
+        pet = project['pet']
+        
+        try:
+            result = scrape_project(pet , driver, f"https://eprm.ypen.gr{project['url']}", tab, session=session)
+            if sink is None:
+                scraped.update(result)
+            elif result:
+                sink(result)
+            
+        except Exception as e:
+            log_error(f"Failed to scrape project from https://eprm.ypen.gr{project['url']}: {str(e)}")
 
+    return scraped
 
 
 def scrape_page(driver, soup, is_public=False):
@@ -255,41 +438,71 @@ def scrape_page(driver, soup, is_public=False):
 
 
 
-def scrape_project(pet, driver, project_url, tab):
-    driver.get(project_url)
-    log_info(f"Loading project page: {project_url}")
+def project_key(pet, project_url):
+    """Key of a project in the scraped output: {pet}_{wN_id}"""
     match = re.search(r"(w\d+_.+)", project_url.replace("/" , "_"))
     if match:
         extracted_value = match.group(1)  # This gets the part starting with w{number} and everything after
-        key = f"{pet}_{extracted_value}"
-    else :
-        key = f"{pet}_{project_url}"
-    
+        return f"{pet}_{extracted_value}"
+    return f"{pet}_{project_url}"
+
+
+def fetch_project_html(session, project_url):
+    """Fetch the html of a project page over plain http with an authenticated session"""
+    response = session.get(project_url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+
+    if 'user/login' in response.url:
+        raise Exception(f"Session expired, redirected to login page for {project_url}")
+
+    return response.text
+
+
+def parse_project(pet, html, project_url):
+    """Parse the panels of a project page into {key: panels}"""
+    key = project_key(pet, project_url)
+
+    try:
+        with metrics.timer('parse_seconds'):
+            panels = extract_project_panels(html, project_url)
+        if panels is None:
+            log_error(f"No panels found in {project_url}")
+            metrics.inc('projects_parsed_total', result='empty')
+            return []
+
+        metrics.inc('projects_parsed_total', result='ok')
+        return {key: panels}
+        
+    except Exception as e:
+        log_error(f"Error scraping project: {str(e)}")
+        metrics.inc('projects_parsed_total', result='error')
+        return []
+
+
+def scrape_project(pet, driver, project_url, tab, session=None):
+    if session is not None:
+        log_info(f"Fetching project page: {project_url}")
+        try:
+            with metrics.timer('fetch_seconds', stage='page'):
+                html = fetch_project_html(session, project_url)
+        except Exception as e:
+            log_error(f"Error fetching project: {str(e)}")
+            return []
+        return parse_project(pet, html, project_url)
+
+    start = time.perf_counter()
+    driver.get(project_url)
+    log_info(f"Loading project page: {project_url}")
     
     try:
         # Wait for panels to load and get page source
         WebDriverWait(driver, 10).until(
             EC.presence_of_element_located((By.CSS_SELECTOR, ".panel-group"))
         )
-        
-        # Parse with BeautifulSoup
-        project_soup = BeautifulSoup(driver.page_source, 'html.parser')
-        
-        # Find all panels
-        panels = project_soup.select('div.panel-default')
-        # log_info(f"Found {len(panels)} panels")
-        
-        results = {}
-        for panel in panels:
-            panel_id = panel.get('id', 'no_id') 
-            panel_data = extract_panel_data(panel, panel_id, project_url)
-            if key in results:
-                results[key].update(panel_data)
-            else:
-                results[key] = panel_data
-            
-        return results
+        metrics.observe('fetch_seconds', time.perf_counter() - start, stage='page')
         
     except Exception as e:
         log_error(f"Error scraping project: {str(e)}")
         return []
+
+    return parse_project(pet, driver.page_source, project_url)
@@ -0,0 +1,137 @@
+import os
+import pickle
+import threading
+
+from loggers import *
+from utils import COOKIE_FILE
+
+
+REFRESH_TIMEOUT = 600        # Seconds a worker waits for a re-login, the CAPTCHA is typed by hand
+
+
+def read_saved_cookies(filename=COOKIE_FILE):
+    """The selenium cookies saved by login, as a list of cookie dicts"""
+    if not os.path.exists(filename):
+        return []
+
+    try:
+        with open(filename, "rb") as file:
+            return pickle.load(file)
+    except Exception as e:
+        log_error(f"Error loading cookies: {e}")
+        return []
+
+
+def authenticate():
+    """Log in with selenium, reusing the saved cookies if they are still valid, and return the cookies"""
+    from login import login
+
+    login(only_login=True)
+    return read_saved_cookies()
+
+
+class SessionBroker:
+    """
+    Logs in once and shares the authenticated cookies with every worker.
+
+    The broker is created in the main process, with a multiprocessing.Manager when the
+    workers are other processes, and passed to them like any other argument. Workers read
+    the cookies with cookies() and call refresh() with the generation they got when they
+    find the session expired. Only the main process logs in, so the CAPTCHA prompt shows
+    up once on its terminal, and requests for a generation that was already replaced are
+    answered with the new cookies instead of another login.
+    """
+
+    def __init__(self, manager=None, authenticate=authenticate):
+        if manager is not None:
+            self.state = manager.dict()
+            self.condition = manager.Condition()
+        else:
+            self.state = {}
+            self.condition = threading.Condition()
+
+        self.state.update({'generation': 0, 'cookies': [], 'requested': False, 'closed': False})
+        self.authenticate = authenticate
+        self.thread = None
+
+    def __getstate__(self):
+        # Workers only need the shared state, the login thread stays in the main process
+        state = self.__dict__.copy()
+        state['thread'] = None
+        return state
+
+    def start(self):
+        """Log in for the first time and start serving the refresh requests of the workers"""
+        cookies = self.authenticate()
+        if not cookies:
+            raise Exception("Login did not produce any cookies")
+
+        with self.condition:
+            self.state.update({'generation': 1, 'cookies': cookies})
+
+        self.thread = threading.Thread(target=self._serve, name='session-broker', daemon=True)
+        self.thread.start()
+        log_info("Session broker started")
+        return self
+
+    def close(self):
+        with self.condition:
+            self.state['closed'] = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def cookies(self):
+        """Return (generation, cookies) of the current session"""
+        with self.condition:
+            return self.state['generation'], list(self.state['cookies'])
+
+    def cookie_dict(self):
+        """Return (generation, {name: value}) of the current session, for requests and aiohttp"""
+        generation, cookies = self.cookies()
+        return generation, {cookie['name']: cookie['value'] for cookie in cookies}
+
+    def refresh(self, generation):
+        """
+        Report that the session of the given generation has expired and wait for a new one.
+
+        Returns:
+        - (generation, cookies) of the new session, the same ones if the login failed
+        """
+        with self.condition:
+            if self.state['generation'] == generation and not self.state['closed']:
+                self.state['requested'] = True
+                self.condition.notify_all()
+                self.condition.wait_for(lambda: self.state['generation'] != generation or self.state['closed']
+                                        or not self.state['requested'], timeout=REFRESH_TIMEOUT)
+            return self.state['generation'], list(self.state['cookies'])
+
+    def _serve(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.state['requested'] or self.state['closed'])
+                if self.state['closed']:
+                    return
+                generation = self.state['generation']
+
+            log_info(f"Session {generation} expired, logging in again")
+            try:
+                cookies = self.authenticate()
+            except BaseException as e:
+                # login() calls exit() when the form fails, keep serving with the old cookies
+                log_error(f"Failed to refresh the session: {e!r}")
+                cookies = None
+
+            with self.condition:
+                if cookies:
+                    self.state.update({'generation': generation + 1, 'cookies': cookies})
+                    log_info(f"Session refreshed, generation {generation + 1}")
+                self.state['requested'] = False
+                self.condition.notify_all()
@@ -1,15 +1,22 @@
 import pickle
 import os
+import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
 
 from loggers import * 
+from drivers import new_driver
 
 
 COOKIE_FILE = "cookies.pkl"
 
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Referer': 'https://eprm.ypen.gr/src/App/',
+}
+
 def is_logged_in(driver):
     """More comprehensive check combining multiple indicators"""
     try:
@@ -22,22 +29,13 @@ def is_logged_in(driver):
         return False
     
 
-def create_driver(project_url):
+def create_driver(project_url, cookies=None, performance_log=False):
     try:
-        """Create and return a new Selenium driver instance."""
-        # Add your driver initialization logic here
-        options = webdriver.ChromeOptions()
-        # options.add_argument('--headless')  
-        # options.add_argument('--disable-gpu')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm -usage')
-        service = Service()
-            
-
-        driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+        """Create and return a new headless Selenium driver instance, with the saved cookies or the given ones.
+        performance_log keeps the DevTools events, e.g. the download progress, for driver.get_log('performance')."""
+        driver = new_driver(performance_log=performance_log)
     
-    
-        if load_cookies(driver, project_url):
+        if load_cookies(driver, project_url, cookies):
             log_info("Probably Restored session from cookies")
                 
         else: 
@@ -60,9 +58,9 @@ def save_cookies(driver):
         pickle.dump(driver.get_cookies(), file)
     log_info("Cookies saved successfully")
 
-def load_cookies(driver, project_url = None):
-    """Load cookies from file and add them to the driver"""
-    if not os.path.exists(COOKIE_FILE):
+def load_cookies(driver, project_url = None, cookies = None):
+    """Load cookies from file, or the given selenium cookie dicts, and add them to the driver"""
+    if cookies is None and not os.path.exists(COOKIE_FILE):
         return False
         
     try:
@@ -72,21 +70,23 @@ def load_cookies(driver, project_url = None):
         else:
             driver.get(project_url)
         
-        with open(COOKIE_FILE, "rb") as file:
-            cookies = pickle.load(file)
+        if cookies is None:
+            with open(COOKIE_FILE, "rb") as file:
+                cookies = pickle.load(file)
             
-            # Clear existing cookies first
-            driver.delete_all_cookies()
-            
-            for cookie in cookies:
-                # Fix domain if needed (some sites require specific domain format)
-                if 'eprm.ypen.gr' not in cookie['domain']:
-                    cookie['domain'] = 'eprm.ypen.gr'
-                try:
-                    driver.add_cookie(cookie)
-                except Exception as e:
-                    log_error(f"Couldn't add cookie: {e}")
-                    continue
+        # Clear existing cookies first
+        driver.delete_all_cookies()
+        
+        for cookie in cookies:
+            cookie = dict(cookie)
+            # Fix domain if needed (some sites require specific domain format)
+            if 'eprm.ypen.gr' not in cookie['domain']:
+                cookie['domain'] = 'eprm.ypen.gr'
+            try:
+                driver.add_cookie(cookie)
+            except Exception as e:
+                log_error(f"Couldn't add cookie: {e}")
+                continue
                     
         log_info("Cookies loaded successfully")
         return True
@@ -94,3 +94,33 @@ def load_cookies(driver, project_url = None):
     except Exception as e:
         log_error(f"Error loading cookies: {e}")
         return False
+
+
+def load_cookie_dict(filename=COOKIE_FILE):
+    """Load the saved selenium cookies as a plain {name: value} dict"""
+    if not os.path.exists(filename):
+        return None
+
+    try:
+        with open(filename, "rb") as file:
+            cookies = pickle.load(file)
+        return {cookie['name']: cookie['value'] for cookie in cookies}
+
+    except Exception as e:
+        log_error(f"Error loading cookies: {e}")
+        return None
+
+def create_http_session(filename=COOKIE_FILE):
+    """Create a requests session that reuses the authenticated cookies from the cookie file"""
+    cookies = load_cookie_dict(filename)
+    if not cookies:
+        log_info('No saved cookies for the http session')
+        return None
+
+    session = requests.Session()
+    session.headers.update(HTTP_HEADERS)
+    for name, value in cookies.items():
+        session.cookies.set(name, value, domain='eprm.ypen.gr')
+
+    log_info("Created http session from saved cookies")
+    return session